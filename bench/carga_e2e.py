@@ -0,0 +1,328 @@
+# Prueba de carga de punta a punta: el bot real (python bot.py, con su
+# Application, handlers, admisión y workers) corre contra una Bot API falsa
+# local (BOT_API_URL). Usuarios simulados mandan comandos y apretan los
+# botones de paginación; se mide desde que el bot recibe el update (respuesta
+# de getUpdates o POST al webhook) hasta que llama a sendMessage /
+# editMessageText. Se corre por escalones de usuarios concurrentes para ver
+# dónde se satura todo el bot. El informe usa el formato de motores.py
+# ("cargas" por escalón), así comparar.py sirve igual.
+#
+# Uso: python bench/carga_e2e.py datos.db [--usuarios 5,20,50,100] [--segundos 20]
+#        [--pausa 1] [--prob-boton 0.5] [--modo polling|webhook] [--salida informe.json]
+# La configuración del bot se pasa por el entorno (DB_WORKERS, PRECARGA, ...);
+# el límite por usuario (TASA_USUARIO) se apaga salvo que venga definido.
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import secrets
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import aiohttp
+from aiohttp import web
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+import bot
+from generar_db import APELLIDOS, NOMBRES, CALLES
+from motores import resumen_ms, commit_actual
+
+TOKEN = "123456:BENCH"
+BOT_USUARIO = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def rss_max_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"): return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+# Bot API falsa: getUpdates con long polling sobre una cola en memoria y
+# respuestas válidas (mensajes con message_id por chat) para lo que el bot
+# manda. Cada usuario tiene a lo sumo un update esperando respuesta, así una
+# llamada a sendMessage / editMessageText a su chat es la respuesta a ese update.
+class BotAPIFalsa:
+    def __init__(self, latencia_ms=0):
+        self.latencia = latencia_ms / 1000
+        self.updates = []     # pendientes de entregar por getUpdates
+        self.hay_updates = asyncio.Event()
+        self.esperando = {}   # chat -> [update_id, entregado, future]
+        self.mensajes = {}    # chat -> último message_id
+        self.llamadas = {}    # método -> n
+        self.polling = asyncio.Event()
+        self._update_id = 0
+
+    def nuevo_update(self, **contenido):
+        self._update_id += 1
+        return {"update_id": self._update_id, **contenido}
+
+    def nuevo_mensaje(self, chat, desde, texto, teclado=None):
+        self.mensajes[chat] = self.mensajes.get(chat, 0) + 1
+        mensaje = {"message_id": self.mensajes[chat], "date": int(time.time()), "chat": {"id": chat, "type": "private"},
+                   "from": desde, "text": texto}
+        if teclado: mensaje["reply_markup"] = teclado
+        return mensaje
+
+    # Devuelve un future con (segundos desde la entrega, mensaje del bot) de
+    # la respuesta al update
+    def esperar_respuesta(self, chat, update):
+        futuro = asyncio.get_running_loop().create_future()
+        self.esperando[chat] = [update["update_id"], None, futuro]
+        return futuro
+
+    def entregado(self, update):
+        for pendiente in self.esperando.values():
+            if pendiente[0] == update["update_id"]: pendiente[1] = time.perf_counter()
+
+    def encolar(self, update):
+        self.updates.append(update)
+        self.hay_updates.set()
+
+    async def get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset", 0))
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.hay_updates.clear()
+            try: await asyncio.wait_for(self.hay_updates.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError: pass
+        entregados = self.updates[:int(params.get("limit", 100))]
+        for u in entregados: self.entregado(u)
+        return entregados
+
+    def responder(self, chat, mensaje):
+        pendiente = self.esperando.get(chat)
+        if pendiente is None or pendiente[1] is None or pendiente[2].done(): return  # avisos fuera de turno
+        del self.esperando[chat]
+        pendiente[2].set_result((time.perf_counter() - pendiente[1], mensaje))
+
+    async def atender(self, request):
+        metodo = request.match_info["metodo"]
+        self.llamadas[metodo] = self.llamadas.get(metodo, 0) + 1
+        params = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        if metodo == "getUpdates": return web.json_response({"ok": True, "result": await self.get_updates(params)})
+        if self.latencia: await asyncio.sleep(self.latencia)  # ida y vuelta a Telegram
+        if metodo == "getMe": return web.json_response({"ok": True, "result": BOT_USUARIO})
+        if metodo in ("sendMessage", "editMessageText"):
+            chat = int(params["chat_id"])
+            teclado = params.get("reply_markup")
+            teclado = json.loads(teclado) if isinstance(teclado, str) else teclado
+            if metodo == "editMessageText":
+                mensaje = {**self.nuevo_mensaje(chat, BOT_USUARIO, params.get("text", ""), teclado), "message_id": int(params["message_id"])}
+            else:
+                mensaje = self.nuevo_mensaje(chat, BOT_USUARIO, params.get("text", ""), teclado)
+            self.responder(chat, mensaje)
+            return web.json_response({"ok": True, "result": mensaje})
+        return web.json_response({"ok": True, "result": True})  # answerCallbackQuery, deleteWebhook, ...
+
+# Acciones de un usuario: un comando nuevo o, si el último mensaje trajo
+# botones, "Sig." / "Ant." con esa probabilidad. Los términos salen del
+# vocabulario del generador, así la mayoría encuentra algo.
+def comando(azar, ids):
+    nombre = lambda: azar.choice(NOMBRES[azar.choice("MF")])
+    return azar.choices([
+        lambda: azar.choice(ids),
+        lambda: f"/apellido {azar.choice(APELLIDOS)[:azar.randint(3, 6)]}",
+        lambda: f"/nombre {nombre()}",
+        lambda: f"/domicilio {azar.choice(CALLES)} {azar.randint(1, 9999)}",
+        lambda: f"/persona {azar.choice(APELLIDOS)} {nombre()}",
+        lambda: f"/finder {azar.choice('MF')} {azar.randint(1940, 2000)} {azar.choice(CALLES)}",
+        lambda: f"/asc {azar.choice('MF')} {azar.randint(1940, 2000)} {azar.choice(APELLIDOS)[:4]}",
+    ], [4, 3, 1, 1, 2, 1, 1])[0]()
+
+def update_texto(api, chat, texto):
+    usuario = {"id": chat, "is_bot": False, "first_name": f"U{chat}"}
+    mensaje = api.nuevo_mensaje(chat, usuario, texto)
+    if texto.startswith("/"): mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto.split()[0])}]
+    return api.nuevo_update(message=mensaje)
+
+def update_boton(api, chat, mensaje, datos):
+    usuario = {"id": chat, "is_bot": False, "first_name": f"U{chat}"}
+    update = api.nuevo_update(callback_query={"from": usuario, "chat_instance": str(chat), "data": datos, "message": mensaje})
+    update["callback_query"]["id"] = str(update["update_id"])
+    return update
+
+class Escalon:
+    def __init__(self):
+        self.latencias = {"comando": [], "boton": []}
+        self.rechazadas = 0   # "⏳ Hay muchas búsquedas en curso" / "Vas muy rápido"
+        self.sin_respuesta = 0
+
+async def usuario(api, enviar, chat, escalon, args, ids, fin):
+    azar = random.Random(args.semilla * 100_003 + chat)
+    ultimo, botones = None, []
+    while time.perf_counter() < fin:
+        await asyncio.sleep(azar.expovariate(1 / args.pausa) if args.pausa > 0 else 0)
+        if botones and azar.random() < args.prob_boton:
+            tipo, update = "boton", update_boton(api, chat, ultimo, azar.choice(botones))
+        else:
+            tipo, update = "comando", update_texto(api, chat, comando(azar, ids))
+        futuro = api.esperar_respuesta(chat, update)
+        await enviar(update)
+        try:
+            segundos, mensaje = await asyncio.wait_for(futuro, args.timeout)
+        except asyncio.TimeoutError:
+            api.esperando.pop(chat, None)
+            escalon.sin_respuesta += 1
+            ultimo, botones = None, []
+            continue
+        if time.perf_counter() > fin: break
+        escalon.latencias[tipo].append(segundos)
+        escalon.rechazadas += mensaje["text"].startswith("⏳")
+        ultimo = mensaje
+        botones = [b["callback_data"] for fila in mensaje.get("reply_markup", {}).get("inline_keyboard", []) for b in fila
+                   if b["callback_data"].startswith("pg|") and not b["callback_data"].endswith("|=")]
+
+# Suma y cantidad de bot_latencia_segundos por fase (todas las etiquetas de
+# comando juntas), leídas del /metrics del propio bot
+_MUESTRA = re.compile(r'^bot_latencia_segundos_(sum|count)\{comando="[^"]*",fase="(\w+)"\} (\S+)$')
+
+async def fases_bot(sesion, url):
+    totales = {}
+    async with sesion.get(url) as r:
+        for linea in (await r.text()).splitlines():
+            m = _MUESTRA.match(linea)
+            if m: totales[(m[2], m[1])] = totales.get((m[2], m[1]), 0) + float(m[3])
+    return totales
+
+def medias_us(antes, despues):
+    res = {}
+    for fase in ("cola", "sql", "render", "total"):
+        n = despues.get((fase, "count"), 0) - antes.get((fase, "count"), 0)
+        if n: res[f"bot_{fase}_media_us"] = round((despues[(fase, "sum")] - antes.get((fase, "sum"), 0)) / n * 1e6, 1)
+    return res
+
+async def correr(args):
+    db = os.path.abspath(args.db)
+    with sqlite3.connect(f"file:{db}?mode=ro", uri=True) as conn:
+        azar = random.Random(args.semilla)
+        maximo = conn.execute(f"SELECT MAX(rowid) FROM {bot.NOMBRE_TABLA}").fetchone()[0]
+        ids = [str(fila[0]) for fila in (conn.execute(f"SELECT {bot.COL_ID_PRINCIPAL} FROM {bot.NOMBRE_TABLA} WHERE rowid = ?",
+                                                      (azar.randint(1, maximo),)).fetchone() for _ in range(1000)) if fila]
+        filas = conn.execute(f"SELECT COUNT(*) FROM {bot.NOMBRE_TABLA}").fetchone()[0]
+
+    api = BotAPIFalsa(args.latencia_api_ms)
+    servidor = web.Application()
+    servidor.router.add_route("POST", "/bot{token}/{metodo}", api.atender)
+    runner = web.AppRunner(servidor, access_log=None)
+    await runner.setup()
+    puerto_api, puerto_bot = puerto_libre(), puerto_libre()
+    await web.TCPSite(runner, "127.0.0.1", puerto_api).start()
+
+    # El bot corre en un directorio temporal con la DB enlazada: la publica
+    # al arrancar y, sin DB_URL, no intenta bajar nada
+    directorio = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.symlink(db, os.path.join(directorio, bot.NOMBRE_DB_LOCAL))
+    entorno = {**os.environ, "TELEGRAM_TOKEN": TOKEN, "BOT_API_URL": f"http://127.0.0.1:{puerto_api}", "PORT": str(puerto_bot),
+               "MODO": args.modo, "WEBHOOK_URL": "", "DB_URL": "", "DB_REFRESCO_MIN": "0"}
+    entorno.setdefault("TASA_USUARIO", "0")
+    entorno["WEBHOOK_SECRET"] = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(16)  # el bot no arranca en webhook sin secreto
+    registro = open(os.path.join(directorio, "bot.log"), "w")
+    proceso = subprocess.Popen([sys.executable, os.path.join(os.path.abspath(RAIZ), "bot.py")], cwd=directorio, env=entorno,
+                               stdout=registro, stderr=subprocess.STDOUT)
+    url_bot = f"http://127.0.0.1:{puerto_bot}"
+    try:
+        async with aiohttp.ClientSession() as sesion:
+            if args.modo == "webhook":
+                async def enviar(update):
+                    api.entregado(update)
+                    async with sesion.post(url_bot + bot.WEBHOOK_RUTA, json=update,
+                                           headers={"X-Telegram-Bot-Api-Secret-Token": entorno["WEBHOOK_SECRET"]}) as r:
+                        if r.status != 200: raise RuntimeError(f"webhook HTTP {r.status}")
+            else:
+                async def enviar(update): api.encolar(update)
+
+            # Listo cuando la Application ya pide updates (polling) o cuando la
+            # salud responde con la DB cargada (webhook)
+            limite = time.perf_counter() + args.arranque
+            while time.perf_counter() < limite:
+                if proceso.poll() is not None: sys.exit(f"❌ El bot terminó al arrancar, ver {registro.name}")
+                if args.modo == "polling" and api.polling.is_set(): break
+                if args.modo == "webhook" and api.llamadas.get("getMe"):
+                    try:
+                        async with sesion.get(url_bot + "/metrics") as r:
+                            if re.search(r"^bot_db_generacion [1-9]", await r.text(), re.M): break
+                    except aiohttp.ClientError: pass
+                await asyncio.sleep(0.2)
+            else:
+                sys.exit(f"❌ El bot no arrancó en {args.arranque}s, ver {registro.name}")
+
+            informe = {"version": 1, "commit": commit_actual(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "db": {"filas": filas, "bytes": os.path.getsize(db)},
+                       "entorno": {"python": platform.python_version(), "cpus": os.cpu_count(), "modo": args.modo,
+                                   "pausa_s": args.pausa, "prob_boton": args.prob_boton, "latencia_api_ms": args.latencia_api_ms,
+                                   **{v: os.getenv(v) for v in ("DB_WORKERS", "DB_COLA_MAX", "PRECARGA") if os.getenv(v)}},
+                       "cargas": {}}
+            previo_qps = None
+            for n in args.usuarios:
+                escalon, antes, llamadas = Escalon(), await fases_bot(sesion, url_bot + "/metrics"), dict(api.llamadas)
+                fin = time.perf_counter() + args.segundos
+                t0 = time.perf_counter()
+                tareas = [asyncio.create_task(usuario(api, enviar, chat, escalon, args, ids, fin)) for chat in range(1, n + 1)]
+                await asyncio.gather(*tareas)
+                duracion = time.perf_counter() - t0
+                todas = escalon.latencias["comando"] + escalon.latencias["boton"]
+                res = {**(resumen_ms(todas) if todas else {"n": 0}), "qps": round(len(todas) / duracion, 1),
+                       "comandos": resumen_ms(escalon.latencias["comando"]) if escalon.latencias["comando"] else None,
+                       "botones": resumen_ms(escalon.latencias["boton"]) if escalon.latencias["boton"] else None,
+                       "rechazadas": escalon.rechazadas, "sin_respuesta": escalon.sin_respuesta,
+                       "llamadas_api": {m: c - llamadas.get(m, 0) for m, c in api.llamadas.items() if c - llamadas.get(m, 0)},
+                       **medias_us(antes, await fases_bot(sesion, url_bot + "/metrics")), "rss_max_mb": rss_max_mb(proceso.pid)}
+                informe["cargas"][f"{n}_usuarios"] = res
+                print(f"🔹 {n} usuarios: p50 {res.get('p50_ms')} ms, p99 {res.get('p99_ms')} ms, {res['qps']} respuestas/s, "
+                      f"{escalon.rechazadas} rechazadas, {escalon.sin_respuesta} sin respuesta", file=sys.stderr)
+                # Saturación: el primer escalón que ya casi no suma respuestas/s
+                if previo_qps and "saturacion_usuarios" not in informe and res["qps"] < previo_qps * 1.05:
+                    informe["saturacion_usuarios"] = n
+                previo_qps = res["qps"]
+                api.esperando.clear()
+    finally:
+        proceso.terminate()  # el bot todavía llama a getUpdates al cerrar: no bloquear el loop de la API falsa
+        try: await asyncio.to_thread(proceso.wait, 10)
+        except subprocess.TimeoutExpired: proceso.kill()
+        registro.close()
+        await runner.cleanup()
+    shutil.rmtree(directorio, ignore_errors=True)  # si algo falló queda, con bot.log
+    return informe
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de punta a punta con una Bot API falsa")
+    parser.add_argument("db")
+    parser.add_argument("--usuarios", default="5,20,50,100", help="escalones de usuarios concurrentes, separados por coma")
+    parser.add_argument("--segundos", type=float, default=20, help="duración de cada escalón")
+    parser.add_argument("--pausa", type=float, default=1, help="pausa media de cada usuario entre acciones (s, exponencial)")
+    parser.add_argument("--prob-boton", type=float, default=0.5, help="probabilidad de apretar un botón de paginación si hay")
+    parser.add_argument("--latencia-api-ms", type=float, default=0, help="demora de la Bot API falsa por llamada")
+    parser.add_argument("--modo", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--timeout", type=float, default=30, help="espera máxima de una respuesta")
+    parser.add_argument("--arranque", type=float, default=300, help="espera máxima hasta que el bot esté listo")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args()
+    args.usuarios = [int(x) for x in args.usuarios.split(",") if x]
+
+    informe = asyncio.run(correr(args))
+    texto = json.dumps(informe, ensure_ascii=False, indent=1)
+    if args.salida:
+        with open(args.salida, "w") as f: f.write(texto + "\n")
+    else:
+        print(texto)
+
+if __name__ == "__main__":
+    main()
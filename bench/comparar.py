@@ -0,0 +1,32 @@
+# Compara dos informes de bench/motores.py (antes / después) carga por carga.
+# Uso: python bench/comparar.py antes.json despues.json
+import sys
+import json
+
+METRICAS = [("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("qps", True), ("render_media_us", False), ("rss_max_mb", False)]
+
+def cambio(antes, despues, mas_es_mejor):
+    if not antes or despues is None: return ""
+    delta = (despues - antes) / antes * 100
+    mejor = delta > 0 if mas_es_mejor else delta < 0
+    return f"{delta:+.1f}% {'✅' if mejor and abs(delta) >= 5 else '⚠️' if abs(delta) >= 5 else ''}"
+
+def main():
+    if len(sys.argv) != 3: sys.exit("Uso: python bench/comparar.py antes.json despues.json")
+    with open(sys.argv[1]) as f: antes = json.load(f)
+    with open(sys.argv[2]) as f: despues = json.load(f)
+    print(f"{antes.get('commit')} ({antes['db']['filas']} filas) -> {despues.get('commit')} ({despues['db']['filas']} filas)")
+    for nombre, res in despues["cargas"].items():
+        previo = antes["cargas"].get(nombre)
+        if previo is None:
+            print(f"\n{nombre}: (nueva)")
+            continue
+        if "recargas" in res:  # la carga de recarga trae dos resúmenes
+            res, previo = {**res["busquedas_durante"], "rss_max_mb": res.get("rss_max_mb")}, {**previo["busquedas_durante"], "rss_max_mb": previo.get("rss_max_mb")}
+        print(f"\n{nombre}:")
+        for metrica, mas_es_mejor in METRICAS:
+            if metrica in res or metrica in previo:
+                print(f"  {metrica:16} {previo.get(metrica)!s:>10} -> {res.get(metrica)!s:>10}  {cambio(previo.get(metrica), res.get(metrica), mas_es_mejor)}")
+
+if __name__ == "__main__":
+    main()
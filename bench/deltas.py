@@ -0,0 +1,144 @@
+# Origen HTTP local que publica una DB base y una serie de deltas (ver el
+# formato en bot.py) para probar actualizar_db de punta a punta: descarga
+# completa, manifiesto sin cambios, cadena de deltas (con upsert parcial, alta,
+# baja, clave distinta del ID y un delta en gzip), triggers FTS al día, caída
+# a la descarga completa cuando falta un eslabón y 304 con el ETag guardado.
+#
+# Uso: python bench/deltas.py [--filas 20000] [--salida informe.json]
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import atexit
+import sqlite3
+import hashlib
+import tempfile
+import argparse
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+import bot
+from generar_db import generar
+from motores import commit_actual
+from descarga import servir, archivo
+
+ID, AP, NO, DOM = bot.COL_ID_PRINCIPAL, bot.COL_APELLIDO, bot.COL_NOMBRE, bot.COL_DOMICILIO
+
+def instantanea(ruta, base, version):
+    shutil.copy(base, ruta)
+    with sqlite3.connect(ruta) as conn: conn.execute(f"PRAGMA user_version = {version}")
+    return ruta
+
+def fila(conn, clave):
+    conn.row_factory = sqlite3.Row
+    r = conn.execute(f'SELECT * FROM {bot.NOMBRE_TABLA} WHERE "{ID}" = ?', (clave,)).fetchone()
+    return dict(r) if r else None
+
+# Texto de la primera página de /buscar sobre `columna`, con y sin FTS: si
+# los triggers dejaron maestra_fts desfasada, las dos difieren
+def buscar(columna, valor):
+    gen = bot.generacion_actual()
+    con_fts = bot.MOTORES["simple"](columna, valor, 0, None)[0]
+    gen.fts, fts = False, gen.fts
+    try: sin_fts = bot.MOTORES["simple"](columna, valor, 0, None)[0]
+    finally: gen.fts = fts
+    return con_fts, con_fts == sin_fts and fts
+
+def main():
+    parser = argparse.ArgumentParser(description="Deltas de la DB contra un origen HTTP local")
+    parser.add_argument("--filas", type=int, default=20000)
+    parser.add_argument("--salida", help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args()
+    if args.salida: args.salida = os.path.abspath(args.salida)
+
+    directorio = tempfile.mkdtemp(prefix="bench_deltas_")
+    atexit.register(shutil.rmtree, directorio, True)
+    os.chdir(directorio)
+    os.mkdir("origen")
+    generar("base.db", args.filas)
+    with sqlite3.connect("base.db") as conn:
+        a, b = [r[0] for r in conn.execute(f'SELECT "{ID}" FROM {bot.NOMBRE_TABLA} WHERE "{DOM}" IS NOT NULL LIMIT 2')]
+        original_a = fila(conn, a)
+    nuevo = 4_000_000
+
+    # Deltas 1 -> 2 -> 3 -> 4; el 2 -> 3 va en gzip y el 3 -> 4 usa APELLIDO como clave
+    deltas = {
+        "1-2.json": {"clave": ID, "borrar": [b], "upsert": [
+            {ID: a, NO: "Delfina"},
+            {ID: nuevo, AP: "Zzyzx", NO: "Ana", DOM: "Calle Falsa 123", bot.COL_SEXO: "F", bot.COL_CLASE: 1990}]},
+        "2-3.json.gz": {"clave": ID, "upsert": [{ID: a, DOM: "Avenida Siempreviva 742"}]},
+        "3-4.json": {"clave": AP, "upsert": [{AP: "Zzyzx", bot.COL_CLASE: 1991}]},
+    }
+    pasos = []
+    for nombre, delta in deltas.items():
+        datos = json.dumps(delta).encode()
+        if nombre.endswith(".gz"): datos = gzip.compress(datos)
+        with open(os.path.join("origen", nombre), "wb") as f: f.write(datos)
+        desde, hasta = map(int, nombre.split(".")[0].split("-"))
+        pasos.append({"desde": desde, "hasta": hasta, "url": f"deltas/{nombre}", "sha256": hashlib.sha256(datos).hexdigest()})
+
+    origen = {"db": instantanea("origen/v1.db", "base.db", 1), "manifiesto": {"version": 1, "deltas": []}}
+    rutas = {"/db": lambda cabeceras: archivo(origen["db"], f'"{os.path.basename(origen["db"])}"')(cabeceras),
+             "/manifiesto.json": lambda cabeceras: (200, {}, [json.dumps(origen["manifiesto"]).encode()])}
+    for nombre in deltas: rutas[f"/deltas/{nombre}"] = archivo(os.path.join("origen", nombre))
+    url, pedidos = servir(rutas)
+    bot.DB_URL, bot.DB_DELTAS_URL = url + "/db", url + "/manifiesto.json"
+
+    informe = {"version": 1, "commit": commit_actual(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), "casos": {}}
+    def caso(nombre, ok, **datos):
+        informe["casos"][nombre] = {"ok": bool(ok), **datos, "pedidos_db": pedidos.get("/db", 0)}
+        print(f"{'✅' if ok else '❌'} {nombre}: {datos}", file=sys.stderr)
+    version = lambda: bot.generacion_actual().version
+
+    # 1. Sin generación publicada: descarga completa de la base
+    estado = bot.actualizar_db()
+    caso("descarga_inicial", estado == bot.DESCARGADA and version() == 1, estado=estado, version=version())
+
+    # 2. El manifiesto sigue en la misma versión: no se baja nada
+    estado = bot.actualizar_db()
+    caso("manifiesto_sin_cambios", estado == bot.SIN_CAMBIOS and pedidos.get("/db") == 1, estado=estado)
+
+    # 3. Cadena 1 -> 4 aplicada sobre una copia local
+    origen["manifiesto"] = {"version": 4, "deltas": pasos}
+    estado = bot.actualizar_db()
+    with sqlite3.connect(bot.NOMBRE_DB_LOCAL) as conn:
+        fila_a, fila_b, fila_nueva = fila(conn, a), fila(conn, b), fila(conn, nuevo)
+        indices = dict(conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index'").fetchall())
+    intactas = {k: v for k, v in original_a.items() if k not in (NO, DOM)}
+    caso("cadena_deltas", estado == bot.DESCARGADA and version() == 4 and pedidos.get("/db") == 1,
+         estado=estado, version=version(), pasos=len(pasos))
+    caso("upsert_parcial", fila_a[NO] == "Delfina" and fila_a[DOM] == "Avenida Siempreviva 742"
+         and all(fila_a[k] == v for k, v in intactas.items()), fila=fila_a)
+    caso("alta_y_baja", fila_b is None and fila_nueva and fila_nueva[bot.COL_CLASE] == 1991, nueva=fila_nueva)
+    indice_ap = indices.get(f"idx_{bot.NOMBRE_TABLA}_{AP}") or ""
+    caso("indices", "NOCASE" in indice_ap.upper() and f"idx_{bot.NOMBRE_TABLA}_delta_{AP}" in indices,
+         nocase=indice_ap, delta=indices.get(f"idx_{bot.NOMBRE_TABLA}_delta_{AP}"))
+    texto_alta, igual_alta = buscar(AP, "zzyzx")
+    texto_mod, igual_mod = buscar(DOM, "siempreviva")
+    texto_viejo, igual_viejo = buscar(DOM, original_a[DOM]) if original_a[DOM] else ("", True)
+    caso("triggers_fts", igual_alta and igual_mod and igual_viejo and "Calle Falsa" in texto_alta and "Delfina" in texto_mod
+         and str(a) not in texto_viejo, fts=bot.generacion_actual().fts)
+
+    # 4. Falta el eslabón 4 -> 6: se baja la DB completa de la versión 6
+    origen["db"], origen["manifiesto"] = instantanea("origen/v6.db", "base.db", 6), {"version": 6, "deltas": pasos}
+    estado = bot.actualizar_db()
+    caso("sin_cadena_descarga_completa", estado == bot.DESCARGADA and version() == 6 and pedidos.get("/db") == 2,
+         estado=estado, version=version())
+
+    # 5. Sin manifiesto de deltas, la descarga condicional recibe 304
+    bot.DB_DELTAS_URL = None
+    estado = bot.actualizar_db()
+    caso("no_modificado", estado == bot.SIN_CAMBIOS and version() == 6 and pedidos.get("/db") == 3, estado=estado)
+    informe["pedidos"] = pedidos
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=1, default=str)
+    if args.salida:
+        with open(args.salida, "w") as f: f.write(texto + "\n")
+    else:
+        print(texto)
+    if not all(c["ok"] for c in informe["casos"].values()): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
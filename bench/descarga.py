@@ -0,0 +1,172 @@
+# Origen HTTP local para probar la descarga de la DB sin red. Sirve un archivo
+# sintético de varios GB (generado al vuelo, con Content-Length y ETag) y mide
+# cuánta memoria suma la descarga en streaming. Después comprueba que un
+# cuerpo truncado o un checksum distinto no tocan la DB publicada, que sigue
+# respondiendo búsquedas, y que una descarga válida sí la reemplaza.
+#
+# Uso: python bench/descarga.py [--mb 2048] [--filas 20000] [--salida informe.json]
+# Necesita espacio en /tmp para el archivo grande (se borra al terminar).
+import os
+import sys
+import json
+import time
+import shutil
+import atexit
+import hashlib
+import tempfile
+import argparse
+import threading
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+import bot
+from generar_db import generar
+from motores import commit_actual
+
+MB = 1024 * 1024
+
+# Servidor HTTP/1.0 (una conexión por pedido) en un hilo. `rutas` mapea el
+# path a una función que recibe las cabeceras del pedido y devuelve (estado,
+# cabeceras, bloques). Si los bloques no llegan al Content-Length declarado,
+# la conexión se cierra igual: el cliente ve un cuerpo truncado.
+def servir(rutas):
+    pedidos = {}
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            ruta = urlsplit(self.path).path
+            pedidos[ruta] = pedidos.get(ruta, 0) + 1
+            if ruta in rutas: estado, cabeceras, bloques = rutas[ruta](self.headers)
+            else: estado, cabeceras, bloques = 404, {"Content-Length": "0"}, ()
+            self.send_response(estado)
+            for nombre, valor in cabeceras.items(): self.send_header(nombre, valor)
+            self.end_headers()
+            try:
+                for bloque in bloques: self.wfile.write(bloque)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        def log_message(self, *args):
+            pass
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_address[1]}", pedidos
+
+def archivo(ruta, etag=None, cortar=None):
+    def responder(cabeceras):
+        if etag and cabeceras.get("If-None-Match") == etag: return 304, {"ETag": etag}, ()
+        with open(ruta, "rb") as f: datos = f.read()
+        salida = {"Content-Length": str(len(datos))}
+        if etag: salida["ETag"] = etag
+        return 200, salida, [datos[:cortar] if cortar else datos]
+    return responder
+
+# Cuerpo sintético: cabecera SQLite y después el mismo bloque pseudoaleatorio
+# repetido, así el servidor no ocupa memoria y el sha256 se calcula sin disco
+def sintetico(mb):
+    bloque = bytearray(os.urandom(MB))
+    bloque[:len(bot.CABECERA_SQLITE)] = bot.CABECERA_SQLITE
+    bloque = bytes(bloque)
+    sha = hashlib.sha256()
+    for _ in range(mb): sha.update(bloque)
+    etag = f'"sintetico-{mb}-{sha.hexdigest()[:12]}"'
+    def responder(cabeceras):
+        if cabeceras.get("If-None-Match") == etag: return 304, {"ETag": etag}, ()
+        return 200, {"Content-Length": str(mb * MB), "ETag": etag}, (bloque for _ in range(mb))
+    return responder, sha.hexdigest()
+
+# RSS del proceso muestreado cada 20 ms mientras corre `funcion`
+def con_rss(funcion, *args):
+    muestras, parar = [], threading.Event()
+    def muestrear():
+        while not parar.wait(0.02): muestras.append(rss_mb())
+    base = rss_mb()
+    hilo = threading.Thread(target=muestrear)
+    hilo.start()
+    t0 = time.perf_counter()
+    try:
+        resultado = funcion(*args)
+    finally:
+        segundos = time.perf_counter() - t0
+        parar.set()
+        hilo.join()
+    return resultado, segundos, base, max(muestras + [rss_mb()])
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            return next((round(int(linea.split()[1]) / 1024, 1) for linea in f if linea.startswith("VmRSS:")), None)
+    except OSError:
+        return None
+
+def sigue_publicada(numero):
+    gen = bot.generacion_actual()
+    texto = bot.MOTORES["simple"](bot.COL_APELLIDO, "gonzalez", 0, None)[0]
+    return gen is not None and gen.numero == numero and texto.startswith("🔎") and not os.path.exists(bot.NOMBRE_DB_LOCAL + ".nueva")
+
+def main():
+    parser = argparse.ArgumentParser(description="Descarga de la DB contra un origen HTTP local")
+    parser.add_argument("--mb", type=int, default=2048, help="tamaño del archivo sintético")
+    parser.add_argument("--filas", type=int, default=20000, help="filas de la DB publicada")
+    parser.add_argument("--salida", help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args()
+    if args.salida: args.salida = os.path.abspath(args.salida)
+
+    # NOMBRE_DB_LOCAL y su meta son relativos al directorio actual
+    directorio = tempfile.mkdtemp(prefix="bench_descarga_")
+    atexit.register(shutil.rmtree, directorio, True)
+    os.chdir(directorio)
+    generar("origen.db", args.filas)
+    shutil.copy("origen.db", "inicial.db")
+    if not bot.publicar_db("inicial.db"): sys.exit("❌ La DB inicial no pasó la validación")
+
+    grande, sha_grande = sintetico(args.mb)
+    with open("origen.db", "rb") as f: sha_origen = hashlib.sha256(f.read()).hexdigest()
+    url, pedidos = servir({"/grande": grande, "/db": archivo("origen.db", '"origen"'),
+                           "/truncada": archivo("origen.db", '"truncada"', cortar=os.path.getsize("origen.db") // 2)})
+    informe = {"version": 1, "commit": commit_actual(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "chunk_bytes": bot.DB_CHUNK_BYTES, "casos": {}}
+    def caso(nombre, ok, **datos):
+        informe["casos"][nombre] = {"ok": ok, **datos}
+        print(f"{'✅' if ok else '❌'} {nombre}: {datos}", file=sys.stderr)
+
+    # 1. Archivo grande en streaming, con checksum: la memoria no crece con el tamaño
+    bot.DB_URL, bot.DB_SHA256 = url + "/grande", sha_grande
+    meta = {}
+    estado, segundos, base, pico = con_rss(bot.descargar_db, "grande.db", meta)
+    caso("grande", estado == bot.DESCARGADA and os.path.getsize("grande.db") == args.mb * MB,
+         estado=estado, mb=args.mb, segundos=round(segundos, 1), mb_s=round(args.mb / segundos, 1),
+         rss_base_mb=base, rss_pico_mb=pico, rss_extra_mb=round(pico - base, 1) if base and pico else None)
+    os.remove("grande.db")
+
+    # 2. Mismo ETag: 304 sin cuerpo
+    bot.guardar_meta(meta)
+    estado = bot.descargar_db("grande.db", {})
+    caso("no_modificado", estado == bot.SIN_CAMBIOS and not os.path.exists("grande.db"), estado=estado)
+    bot.guardar_meta({})
+
+    # 3 y 4. Cuerpo truncado y checksum distinto: falla y sigue la generación publicada
+    numero = bot.generacion_actual().numero
+    bot.DB_URL, bot.DB_SHA256 = url + "/truncada", None
+    estado = bot.actualizar_db()
+    caso("truncada", estado == bot.FALLIDA and sigue_publicada(numero), estado=estado)
+    bot.DB_URL, bot.DB_SHA256 = url + "/db", "0" * 64
+    estado = bot.actualizar_db()
+    caso("checksum_distinto", estado == bot.FALLIDA and sigue_publicada(numero), estado=estado)
+
+    # 5. Control: la misma DB con el checksum correcto se publica
+    bot.DB_SHA256 = sha_origen
+    estado = bot.actualizar_db()
+    caso("valida", estado == bot.DESCARGADA and sigue_publicada(numero + 1), estado=estado)
+    informe["pedidos"] = pedidos
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=1)
+    if args.salida:
+        with open(args.salida, "w") as f: f.write(texto + "\n")
+    else:
+        print(texto)
+    if not all(c["ok"] for c in informe["casos"].values()): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Genera una DB `maestra` sintética (mismo esquema COL_* que el bot) para los
+# benchmarks. Nombres, calles, SEXO y CLASE salen de listas inventadas con
+# frecuencias tipo Zipf: unos pocos apellidos y calles muy repetidos y una
+# cola larga, como en un padrón real.
+#
+# Uso: python bench/generar_db.py salida.db --filas 1000000 [--semilla 1]
+import os
+import sys
+import math
+import time
+import random
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bot import NOMBRE_TABLA, COL_ID_PRINCIPAL, COL_APELLIDO, COL_NOMBRE, COL_DOMICILIO, COL_SEXO, COL_CLASE
+
+APELLIDOS = ["Gonzalez", "Rodriguez", "Gomez", "Fernandez", "Lopez", "Diaz", "Martinez", "Perez", "Garcia", "Sanchez",
+             "Romero", "Sosa", "Alvarez", "Torres", "Ruiz", "Ramirez", "Flores", "Acosta", "Benitez", "Medina",
+             "Suarez", "Herrera", "Aguirre", "Pereyra", "Gutierrez", "Gimenez", "Molina", "Silva", "Castro", "Rojas",
+             "Ortiz", "Nuñez", "Luna", "Juarez", "Cabrera", "Rios", "Ferreyra", "Godoy", "Morales", "Dominguez",
+             "Moreno", "Peralta", "Vega", "Carrizo", "Quiroga", "Castillo", "Ledesma", "Muñoz", "Ojeda", "Ponce",
+             "Vera", "Vazquez", "Villalba", "Cardozo", "Navarro", "Ramos", "Arias", "Coronel", "Cordoba", "Figueroa",
+             "Correa", "Caceres", "Vargas", "Maldonado", "Mansilla", "Farias", "Rivero", "Paz", "Miranda", "Roldan",
+             "Mendez", "Lucero", "Cruz", "Hernandez", "Aguero", "Paez", "Blanco", "Mendoza", "Barrios", "Escobar",
+             "Avila", "Soria", "Leiva", "Acuña", "Martin", "Maidana", "Moyano", "Campos", "Olivera", "Duarte",
+             "Soto", "Bustos", "Chavez", "Peña", "Velazquez", "Zapata", "Bravo", "Ibañez", "Iñiguez", "Echeverria"]
+NOMBRES = {"M": ["Juan", "Carlos", "Jose", "Luis", "Jorge", "Miguel", "Daniel", "Ricardo", "Roberto", "Hector",
+                 "Mario", "Oscar", "Pedro", "Alberto", "Ramon", "Sergio", "Raul", "Ruben", "Hugo", "Eduardo",
+                 "Julio", "Diego", "Pablo", "Martin", "Sebastian", "Nicolas", "Matias", "Facundo", "Agustin", "Joaquin"],
+           "F": ["Maria", "Ana", "Silvia", "Graciela", "Marta", "Susana", "Patricia", "Laura", "Claudia", "Norma",
+                 "Alicia", "Beatriz", "Rosa", "Mirta", "Elena", "Liliana", "Monica", "Carmen", "Lucia", "Sofia",
+                 "Valeria", "Carolina", "Florencia", "Gabriela", "Natalia", "Paula", "Andrea", "Romina", "Julieta", "Camila"]}
+SEGUNDOS = ["", "", "", " Beatriz", " Jose", " Ines", " Alberto", " Luis", " Ester", " Antonio"]
+CALLES = ["San Martin", "Belgrano", "Rivadavia", "Mitre", "Sarmiento", "Moreno", "Urquiza", "Alem", "Independencia",
+          "9 de Julio", "25 de Mayo", "Italia", "España", "Colon", "Lavalle", "Alvear", "Roca", "Pellegrini",
+          "Las Heras", "Entre Rios", "Corrientes", "Tucuman", "Salta", "Jujuy", "Catamarca", "La Rioja", "Cordoba",
+          "Santa Fe", "Buenos Aires", "Chacabuco", "Maipu", "Suipacha", "Brown", "Dorrego", "Güemes", "Pueyrredon",
+          "Castelli", "Paso", "Saavedra", "Laprida", "Azcuenaga", "Balcarce", "Caseros", "Ituzaingo", "Peñaloza"]
+BARRIOS = ["", "", "", " - Bº Centro", " - Bº Norte", " - Bº Sur", " - Bº Jardin", " - Bº Obrero", " - Bº Parque"]
+
+def pesos_zipf(n, s=1.0):
+    return [1 / (i + 1) ** s for i in range(n)]
+
+def filas(n, semilla):
+    azar = random.Random(semilla)
+    pesos_ap, pesos_calles = pesos_zipf(len(APELLIDOS)), pesos_zipf(len(CALLES), 0.8)
+    pesos_no = {s: pesos_zipf(len(v), 0.7) for s, v in NOMBRES.items()}
+    # IDs únicos y desordenados (tipo DNI): permutación lineal de [0, m)
+    m = max(n, 1)
+    paso = 2_654_435_761 % m or 1
+    while math.gcd(paso, m) != 1: paso += 1
+    lote = 50_000
+    for inicio in range(0, n, lote):
+        k = min(lote, n - inicio)
+        apellidos = azar.choices(APELLIDOS, pesos_ap, k=k)
+        calles = azar.choices(CALLES, pesos_calles, k=k)
+        for j in range(k):
+            i = inicio + j
+            sexo = "M" if azar.random() < 0.49 else "F"
+            nombre = azar.choices(NOMBRES[sexo], pesos_no[sexo])[0] + azar.choice(SEGUNDOS)
+            if azar.random() < 0.01: domicilio = None  # celdas vacías como en la planilla original
+            else: domicilio = f"{calles[j]} {azar.randint(1, 9999)}{azar.choice(BARRIOS)}"
+            clase = min(2008, max(1925, int(azar.gauss(1975, 16))))
+            yield (5_000_000 + (i * paso) % m, apellidos[j], nombre, domicilio, sexo, clase)
+
+def generar(ruta, n, semilla=1):
+    if os.path.exists(ruta): os.remove(ruta)
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(f'CREATE TABLE {NOMBRE_TABLA} ("{COL_ID_PRINCIPAL}" INTEGER, "{COL_APELLIDO}" TEXT, "{COL_NOMBRE}" TEXT, '
+                 f'"{COL_DOMICILIO}" TEXT, "{COL_SEXO}" TEXT, "{COL_CLASE}" INTEGER)')
+    conn.executemany(f"INSERT INTO {NOMBRE_TABLA} VALUES (?, ?, ?, ?, ?, ?)", filas(n, semilla))
+    conn.commit()
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DB maestra sintética para benchmarks")
+    parser.add_argument("salida")
+    parser.add_argument("--filas", type=int, default=1_000_000)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    generar(args.salida, args.filas, args.semilla)
+    print(f"✅ {args.filas} filas en {args.salida} ({os.path.getsize(args.salida) / 1024 / 1024:.0f} MB, {time.perf_counter() - t0:.0f}s)")
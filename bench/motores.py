@@ -0,0 +1,222 @@
+# Benchmark de los motores de búsqueda sobre una DB sintética (generar_db.py).
+# Por cada carga mide latencia secuencial (p50/p95/p99, con el reparto SQL /
+# render que registra el propio motor) y throughput con varios hilos. Además:
+# paginación profunda siguiendo cursores y recargas de la DB con búsquedas en
+# curso. El informe es JSON para comparar entre commits (ver comparar.py).
+#
+# Uso: python bench/motores.py datos.db [--n 300] [--segundos 3] [--hilos 4] [--salida informe.json]
+# La DB se usa en el lugar (la primera corrida le agrega índices y FTS). La
+# configuración del bot (DB_WORKERS, BUSQUEDA_MAX_MS, ...) se toma del entorno;
+# con DB_PROCESOS > 0 las búsquedas van a los procesos SQL, como en el bot.
+import os
+import sys
+import json
+import shutil
+import atexit
+import time
+import random
+import resource
+import tempfile
+import argparse
+import platform
+import threading
+import multiprocessing
+import subprocess
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+import bot
+from generar_db import APELLIDOS, NOMBRES, CALLES
+
+def percentil(ordenados, p):
+    if not ordenados: return None
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def resumen_ms(latencias):
+    ordenados = sorted(latencias)
+    return {"n": len(ordenados), "p50_ms": round(percentil(ordenados, 50) * 1000, 3), "p95_ms": round(percentil(ordenados, 95) * 1000, 3),
+            "p99_ms": round(percentil(ordenados, 99) * 1000, 3), "max_ms": round(ordenados[-1] * 1000, 3),
+            "media_ms": round(sum(ordenados) / len(ordenados) * 1000, 3)}
+
+def rss_max_mb():
+    # con procesos SQL, suma de los picos de cada uno (las páginas compartidas cuentan en todos)
+    hijos = sum(rss_proceso_kb(p.pid) for p in multiprocessing.active_children())
+    return round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + hijos) / 1024, 1)
+
+def rss_proceso_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            return next((int(linea.split()[1]) for linea in f if linea.startswith("VmHWM:")), 0)
+    except OSError:
+        return 0
+
+def llamar(motor, *args):
+    if bot._procesos is not None: return bot._procesos.ejecutar(motor, args)
+    return motor(*args)
+
+# Medias por fase que el motor registra en bot.LATENCIAS bajo la etiqueta COMANDO
+def fases(etiqueta):
+    res = {}
+    for fase in ("sql", "render"):
+        h = bot.LATENCIAS.get((etiqueta, fase))
+        if h and sum(h.cuentas): res[f"{fase}_media_us"] = round(h.suma / sum(h.cuentas) * 1e6, 1)
+    return res
+
+# Cargas: nombre -> (motor, generador de argumentos). Los términos salen del
+# mismo vocabulario que el generador, así la mayoría encuentra algo.
+def cargas(ids):
+    def nombre_de(azar): return azar.choice(NOMBRES[azar.choice("MF")])
+    return {
+        "id_exacto":    (bot.obtener_datos_paginados, lambda a: (bot.COL_ID_PRINCIPAL, str(a.choice(ids)))),
+        "id_parcial":   (bot.obtener_datos_paginados, lambda a: (bot.COL_ID_PRINCIPAL, str(a.choice(ids))[:5])),
+        "apellido":     (bot.obtener_datos_paginados, lambda a: (bot.COL_APELLIDO, a.choice(APELLIDOS)[:a.randint(3, 6)])),
+        "nombre":       (bot.obtener_datos_paginados, lambda a: (bot.COL_NOMBRE, nombre_de(a))),
+        "domicilio":    (bot.obtener_datos_paginados, lambda a: (bot.COL_DOMICILIO, f"{a.choice(CALLES)} {a.randint(1, 9999)}")),
+        "combinados":   (bot.obtener_datos_combinados, lambda a: (a.choice("MF"), str(a.randint(1940, 2000)), a.choice(CALLES))),
+        "persona":      (bot.obtener_datos_persona, lambda a: (a.choice(APELLIDOS), nombre_de(a))),
+        "asc":          (bot.obtener_datos_asc, lambda a: (a.choice("MF"), str(a.randint(1940, 2000)), a.choice(APELLIDOS)[:4])),
+    }
+
+def correr_secuencial(etiqueta, motor, argumentos, n, semilla):
+    azar = random.Random(semilla)
+    bot.COMANDO.set(etiqueta)
+    for _ in range(min(20, n)): llamar(motor, *argumentos(azar))  # calentamiento
+    bot.LATENCIAS.clear()
+    latencias, vacias, cortadas = [], 0, 0
+    for _ in range(n):
+        args = argumentos(azar)
+        t0 = time.perf_counter()
+        mensaje = llamar(motor, *args)[0]
+        latencias.append(time.perf_counter() - t0)
+        vacias += mensaje.startswith("❌")
+        cortadas += mensaje.startswith("✂️")
+    return {**resumen_ms(latencias), **fases(etiqueta), "vacias": vacias, "cortadas": cortadas}
+
+def correr_concurrente(motor, argumentos, hilos, segundos, semilla):
+    fin = time.perf_counter() + segundos
+    hechas = [0] * hilos
+    def trabajar(i):
+        azar = random.Random(semilla + i)
+        while time.perf_counter() < fin:
+            llamar(motor, *argumentos(azar))
+            hechas[i] += 1
+    ts = [threading.Thread(target=trabajar, args=(i,)) for i in range(hilos)]
+    t0 = time.perf_counter()
+    for t in ts: t.start()
+    for t in ts: t.join()
+    return round(sum(hechas) / (time.perf_counter() - t0), 1)
+
+# Sigue "Sig." con cursores de rowid, como los botones, sobre una búsqueda amplia
+def paginacion_profunda(paginas):
+    bot.COMANDO.set("paginacion_profunda")
+    bot.LATENCIAS.clear()
+    latencias, desde = [], None
+    for pagina in range(paginas):
+        t0 = time.perf_counter()
+        _, tiene_mas, limites, _ = llamar(bot.obtener_datos_paginados, bot.COL_APELLIDO, APELLIDOS[0], pagina, desde)
+        latencias.append(time.perf_counter() - t0)
+        if not tiene_mas: break
+        desde = f">{limites[1]}"
+    t0 = time.perf_counter()
+    llamar(bot.obtener_datos_paginados, bot.COL_APELLIDO, APELLIDOS[0], len(latencias) - 1, None)  # misma página por OFFSET
+    offset_ms = (time.perf_counter() - t0) * 1000
+    return {**resumen_ms(latencias), **fases("paginacion_profunda"), "paginas": len(latencias),
+            "ultima_ms": round(latencias[-1] * 1000, 3), "misma_por_offset_ms": round(offset_ms, 3)}
+
+# Publica la misma DB varias veces (valida, provisiona, cambia de generación)
+# mientras un hilo sigue buscando: duración de la recarga y latencia de las
+# búsquedas que la atraviesan.
+def recargas(veces, argumentos, motor):
+    parar = threading.Event()
+    latencias = []
+    def buscar():
+        azar = random.Random(7)
+        bot.COMANDO.set("durante_recarga")
+        while not parar.is_set():
+            t0 = time.perf_counter()
+            llamar(motor, *argumentos(azar))
+            latencias.append(time.perf_counter() - t0)
+    hilo = threading.Thread(target=buscar)
+    hilo.start()
+    duraciones = []
+    try:
+        for _ in range(veces):
+            t0 = time.perf_counter()
+            if not bot.publicar_db(bot.NOMBRE_DB_LOCAL): raise RuntimeError("la recarga fue rechazada")
+            duraciones.append(time.perf_counter() - t0)
+    finally:
+        parar.set()
+        hilo.join()
+    return {"recargas": resumen_ms(duraciones), "busquedas_durante": resumen_ms(latencias)}
+
+def commit_actual():
+    try: return subprocess.run(["git", "-C", RAIZ, "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError: return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los motores de búsqueda")
+    parser.add_argument("db")
+    parser.add_argument("--n", type=int, default=300, help="búsquedas secuenciales por carga")
+    parser.add_argument("--segundos", type=float, default=3, help="duración de la fase concurrente por carga")
+    parser.add_argument("--hilos", type=int, default=bot.DB_WORKERS)
+    parser.add_argument("--paginas", type=int, default=200, help="páginas de la paginación profunda")
+    parser.add_argument("--recargas", type=int, default=3)
+    parser.add_argument("--cargas", help="solo estas cargas, separadas por coma")
+    parser.add_argument("--con-cache", action="store_true", help="dejar activa la caché de totales")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="archivo JSON (por defecto, stdout)")
+    args = parser.parse_args()
+
+    # publicar_db trabaja sobre NOMBRE_DB_LOCAL del directorio actual: se
+    # enlaza la DB pedida en un directorio temporal, que se borra al salir.
+    # Las rutas del usuario se resuelven antes de cambiar de directorio.
+    db = os.path.abspath(args.db)
+    if args.salida: args.salida = os.path.abspath(args.salida)
+    directorio = tempfile.mkdtemp(prefix="bench_")
+    atexit.register(shutil.rmtree, directorio, True)
+    os.chdir(directorio)
+    os.symlink(db, bot.NOMBRE_DB_LOCAL)
+    if not args.con_cache:
+        bot.CACHE_TOTALES.max_entradas = 0
+        os.environ["CACHE_TOTALES_MAX"] = "0"  # los procesos SQL leen la configuración al arrancar
+    if bot.DB_PROCESOS > 0: bot.iniciar_procesos()
+    t0 = time.perf_counter()
+    if not bot.publicar_db(bot.NOMBRE_DB_LOCAL): sys.exit("❌ La DB no pasó la validación")
+    carga_s = time.perf_counter() - t0
+    gen = bot.generacion_actual()
+
+    with gen.prestar() as conn:
+        maximo = conn.execute(f"SELECT MAX(rowid) FROM {bot.NOMBRE_TABLA}").fetchone()[0]
+        azar = random.Random(args.semilla)
+        ids = [fila[0] for fila in (conn.execute(f"SELECT {bot.COL_ID_PRINCIPAL} FROM {bot.NOMBRE_TABLA} WHERE rowid = ?",
+                                                 (azar.randint(1, maximo),)).fetchone() for _ in range(1000)) if fila]
+
+    informe = {"version": 1, "commit": commit_actual(), "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "db": {"filas": gen.filas, "bytes": gen.bytes, "fts": gen.fts, "carga_s": round(carga_s, 2),
+                      "indices_s": round(bot.ULTIMA_CARGA.get("indices_s", 0), 2)},
+               "entorno": {"python": platform.python_version(), "sqlite": bot.sqlite3.sqlite_version, "cpus": os.cpu_count(),
+                           "hilos": args.hilos, "procesos": bot.DB_PROCESOS, "pool": bot.DB_POOL_TAMANO, "cache_totales": args.con_cache},
+               "cargas": {}}
+    elegidas = set(args.cargas.split(",")) if args.cargas else None
+    for nombre, (motor, argumentos) in cargas(ids).items():
+        if elegidas and nombre not in elegidas: continue
+        res = correr_secuencial(nombre, motor, argumentos, args.n, args.semilla)
+        res["qps"] = correr_concurrente(motor, argumentos, args.hilos, args.segundos, args.semilla)
+        res["rss_max_mb"] = rss_max_mb()
+        informe["cargas"][nombre] = res
+        print(f"🔹 {nombre}: p50 {res['p50_ms']} ms, p99 {res['p99_ms']} ms, {res['qps']} búsquedas/s", file=sys.stderr)
+    if not elegidas or "paginacion_profunda" in elegidas:
+        informe["cargas"]["paginacion_profunda"] = {**paginacion_profunda(args.paginas), "rss_max_mb": rss_max_mb()}
+    if args.recargas and (not elegidas or "recarga" in elegidas):
+        motor, argumentos = cargas(ids)["apellido"]
+        informe["cargas"]["recarga"] = {**recargas(args.recargas, argumentos, motor), "rss_max_mb": rss_max_mb()}
+    informe["rss_max_mb"] = rss_max_mb()
+
+    texto = json.dumps(informe, ensure_ascii=False, indent=1)
+    if args.salida:
+        with open(args.salida, "w") as f: f.write(texto + "\n")
+    else:
+        print(texto)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,54 @@
 import os
 import math
+import gzip
+import json
+import time
+import random
+import signal
+import types
+import queue
+import asyncio
+import bisect
+import contextvars
 import logging
 import sqlite3
+import sys
+import base64
+import hashlib
+import hmac
+import shutil
+import pathlib
+import threading
+import functools
+import multiprocessing
 import requests
-from threading import Thread
-from flask import Flask
+from urllib.parse import urljoin
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, ApplicationHandlerStop, filters
 
 # --- 1. CONFIGURACIÓN Y VARIABLES ---
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+BOT_API_URL = os.getenv("BOT_API_URL")  # otra Bot API (servidor propio o de pruebas), opcional
+
+# Recepción de updates: "polling" (getUpdates) o "webhook" (Telegram hace POST
+# al servidor web del bot, el mismo que responde la salud en PORT)
+MODO           = os.getenv("MODO", "polling")
+PORT           = int(os.getenv("PORT", "8080"))
+WEBHOOK_URL    = os.getenv("WEBHOOK_URL", "")          # URL pública del servidor, sin la ruta (vacío = no registrar)
+WEBHOOK_RUTA   = os.getenv("WEBHOOK_RUTA", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")       # se compara con X-Telegram-Bot-Api-Secret-Token (obligatorio en webhook)
 DB_URL = os.getenv("DB_URL") 
+DB_SHA256     = os.getenv("DB_SHA256")      # checksum esperado de la DB (opcional)
+DB_SHA256_URL = os.getenv("DB_SHA256_URL")  # o URL de un archivo estilo sha256sum (opcional)
+DB_DELTAS_URL = os.getenv("DB_DELTAS_URL")  # manifiesto de deltas publicado junto a la DB (opcional)
+DB_CHUNK_BYTES = int(os.getenv("DB_CHUNK_BYTES", str(1024 * 1024)))
+DB_REFRESCO_MIN      = float(os.getenv("DB_REFRESCO_MIN", "60"))      # refresco automático (0 = apagado)
+DB_REFRESCO_JITTER   = float(os.getenv("DB_REFRESCO_JITTER", "0.1"))  # ± fracción aleatoria del intervalo
+DB_REINTENTO_SEG     = float(os.getenv("DB_REINTENTO_SEG", "30"))     # primer reintento tras un fallo (se duplica)
 
 NOMBRE_DB_LOCAL = "datos_seguros.db"
 NOMBRE_TABLA = "maestra"      
@@ -24,21 +62,146 @@ COL_SEXO         = "SEXO"
 COL_CLASE        = "CLASE"    
 
 RESULTADOS_POR_PAGINA = 5 
+# Columnas que se muestran de cada resultado, en orden, separadas por coma (vacío = todas)
+COLUMNAS_MOSTRAR = [c.strip() for c in os.getenv("COLUMNAS_MOSTRAR", "").split(",") if c.strip()]
+CONTEO_MAX = int(os.getenv("CONTEO_MAX", "1000"))  # tope del conteo de resultados (0 = siempre exacto)
+
+# Caché de totales entre páginas (ver sección 3)
+CACHE_TOTALES_MAX = int(os.getenv("CACHE_TOTALES_MAX", "10000"))   # entradas
+CACHE_TOTALES_MB  = float(os.getenv("CACHE_TOTALES_MB", "8"))
+CACHE_TOTALES_TTL = float(os.getenv("CACHE_TOTALES_TTL", "600"))   # segundos
+
+# Caché de páginas ya armadas + precarga de la siguiente (ver sección 4)
+CACHE_PAGINAS_MAX = int(os.getenv("CACHE_PAGINAS_MAX", "2000"))
+CACHE_PAGINAS_MB  = float(os.getenv("CACHE_PAGINAS_MB", "16"))
+CACHE_PAGINAS_TTL = float(os.getenv("CACHE_PAGINAS_TTL", "300"))
+PRECARGA = os.getenv("PRECARGA", "1") == "1"
+
+# Estado de paginación de cada búsqueda (ver sección 4)
+ESTADOS_MAX = int(os.getenv("ESTADOS_MAX", "20000"))
+ESTADOS_MB  = float(os.getenv("ESTADOS_MB", "16"))
+ESTADOS_TTL = float(os.getenv("ESTADOS_TTL", "86400"))  # segundos sin tocar la búsqueda
+
+# Workers SQL: búsquedas simultáneas y cuántas más pueden esperar turno
+DB_WORKERS  = int(os.getenv("DB_WORKERS", "4"))
+DB_COLA_MAX = int(os.getenv("DB_COLA_MAX", "32"))
+DB_PROCESOS = int(os.getenv("DB_PROCESOS", "0"))  # procesos SQL aparte, para usar más de un núcleo (0 = todo en este proceso)
+BLOQUEO_AVISO_MS = float(os.getenv("BLOQUEO_AVISO_MS", "50"))  # paso del loop que se loguea como lento
+
+# Pool de conexiones de solo lectura (ver sección 2)
+DB_POOL_TAMANO = int(os.getenv("DB_POOL_TAMANO", str(DB_WORKERS)))
+DB_CACHE_KB    = int(os.getenv("DB_CACHE_KB", "65536"))              # cache de páginas por conexión
+DB_MMAP_BYTES  = int(os.getenv("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+DB_CAIDA_MAX_FILAS = float(os.getenv("DB_CAIDA_MAX_FILAS", "0.5"))  # caída de filas tolerada entre generaciones
+DB_ANALYZE_LIMITE  = int(os.getenv("DB_ANALYZE_LIMITE", "0"))        # PRAGMA analysis_limit (0 = ANALYZE completo)
+FTS_TRIGRAMA  = os.getenv("FTS_TRIGRAMA", "1") == "1"   # índice FTS5 trigram para los LIKE '%x%'
+FTS_MIN_CHARS = max(3, int(os.getenv("FTS_MIN_CHARS", "3")))  # el trigram solo acelera términos de 3+ caracteres
+
+# Registro de búsquedas lentas (ver sección 3) y administradores (/lentas)
+LENTA_MS       = float(os.getenv("LENTA_MS", "500"))        # umbral del registro (0 = apagado)
+LENTAS_MAX     = int(os.getenv("LENTAS_MAX", "50"))         # últimas N búsquedas lentas que se guardan
+LENTA_SENTENCIAS_MAX = int(os.getenv("LENTA_SENTENCIAS_MAX", "10"))  # sentencias que se guardan por búsqueda lenta
+DB_PASOS_AVISO = int(os.getenv("DB_PASOS_AVISO", "10000"))  # cada cuántas instrucciones de la VM corre el progress handler
+BUSQUEDA_MAX_MS    = float(os.getenv("BUSQUEDA_MAX_MS", "5000"))  # presupuesto de tiempo por búsqueda (0 = sin límite)
+BUSQUEDA_MAX_PASOS = int(os.getenv("BUSQUEDA_MAX_PASOS", "0"))     # presupuesto de pasos de la VM (0 = sin límite)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# Admisión (ver sección 4): quién puede usar el bot y a qué ritmo
+USUARIOS_PERMITIDOS = {int(x) for x in os.getenv("USUARIOS_PERMITIDOS", "").replace(" ", "").split(",") if x}  # vacío = todos
+TASA_USUARIO     = float(os.getenv("TASA_USUARIO", "1"))    # updates por segundo sostenidos por usuario (0 = sin límite)
+RAFAGA_USUARIO   = float(os.getenv("RAFAGA_USUARIO", "5"))  # ráfaga permitida antes de limitar
+CUBETAS_MAX      = int(os.getenv("CUBETAS_MAX", "10000"))   # usuarios con cubeta en memoria
+COLA_POR_USUARIO = int(os.getenv("COLA_POR_USUARIO", "4"))  # búsquedas en espera por usuario con los workers ocupados
+
+# --- SERVIDOR WEB (SALUD + WEBHOOK) ---
+# Corre en el mismo event loop que el bot: sin hilo aparte. En modo webhook
+# cada POST se valida, se encola en la Application y se responde enseguida.
+# Sin WEBHOOK_SECRET cualquiera que llegue a PORT podría inventar updates
+# (con el from.id de un admin, por ejemplo): el bot no arranca así.
+async def home(request):
+    return web.Response(text="🤖 Bot activo v5 (ASC).")
+
+async def recibir_update(request):
+    recibido = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(recibido.encode(), WEBHOOK_SECRET.encode()):
+        return web.Response(status=403)
+    app_bot = request.app["bot"]
+    try:
+        update = Update.de_json(await request.json(), app_bot.bot)
+    except Exception:
+        return web.Response(status=400)
+    await app_bot.update_queue.put(update)
+    return web.Response()
+
+# Exposición en formato de texto de Prometheus (se arma solo al consultar)
+def texto_metricas():
+    lineas = []
+    def metrica(nombre, tipo, ayuda, muestras):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        lineas.extend(f"{nombre}{etiquetas} {valor}" for etiquetas, valor in muestras)
 
-# --- SERVIDOR WEB (KEEP-ALIVE) ---
-app = Flask('')
+    lineas.append("# HELP bot_latencia_segundos Latencia por handler y fase (cola, sql, render, total)")
+    lineas.append("# TYPE bot_latencia_segundos histogram")
+    with _metricas_lock:
+        latencias = sorted((clave, h.cubetas, list(h.cuentas), h.suma) for clave, h in LATENCIAS.items())
+        contadores = sorted(CONTADORES.items())
+    for (comando, fase), cubetas, cuentas, suma in latencias:
+        base = f'comando="{comando}",fase="{fase}"'
+        acumulado = 0
+        for limite, n in zip(cubetas + ("+Inf",), cuentas):
+            acumulado += n
+            lineas.append(f'bot_latencia_segundos_bucket{{{base},le="{limite}"}} {acumulado}')
+        lineas.append(f"bot_latencia_segundos_sum{{{base}}} {suma}")
+        lineas.append(f"bot_latencia_segundos_count{{{base}}} {acumulado}")
 
-@app.route('/')
-def home():
-    return "🤖 Bot activo v5 (ASC)."
+    ayudas = {"bot_filas_leidas_total": "Filas devueltas en páginas", "bot_filas_contadas_total": "Filas recorridas por los conteos (acotados)",
+              "bot_refrescos_total": "Actualizaciones de la DB por resultado",
+              "bot_consultas_lentas_total": "Búsquedas que superaron LENTA_MS",
+              "bot_busquedas_cortadas_total": "Búsquedas interrumpidas por el presupuesto de tiempo o pasos",
+              "bot_rechazos_total": "Updates o búsquedas rechazadas por motivo",
+              "bot_busquedas_compartidas_total": "Pedidos que esperaron una búsqueda idéntica ya en curso"}
+    for nombre, ayuda in ayudas.items():
+        metrica(nombre, "counter", ayuda, [(f'{{{e}="{v}"}}', n) for (m, e, v), n in contadores if m == nombre])
 
-def run():
-    port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
+    caches = {"totales": CACHE_TOTALES, "paginas": CACHE_PAGINAS, "estados": ESTADOS}
+    metrica("bot_cache_aciertos_total", "counter", "Aciertos por caché", [(f'{{cache="{c}"}}', x.aciertos) for c, x in caches.items()])
+    metrica("bot_cache_fallos_total", "counter", "Fallos por caché", [(f'{{cache="{c}"}}', x.fallos) for c, x in caches.items()])
+    metrica("bot_cache_entradas", "gauge", "Entradas por caché", [(f'{{cache="{c}"}}', len(x)) for c, x in caches.items()])
+    metrica("bot_cache_bytes", "gauge", "Bytes aproximados por caché", [(f'{{cache="{c}"}}', x.bytes) for c, x in caches.items()])
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+    metrica("bot_sql_pendientes", "gauge", "Búsquedas en ejecución", [("", _pendientes)])
+    metrica("bot_sql_en_espera", "gauge", "Búsquedas esperando turno (cola justa)", [("", _turnos.esperando)])
+    metrica("bot_usuarios_en_espera", "gauge", "Usuarios con búsquedas esperando turno", [("", len(_turnos._colas))])
+    metrica("bot_sql_workers", "gauge", "Hilos SQL", [("", DB_WORKERS)])
+    metrica("bot_sql_procesos", "gauge", "Procesos SQL (0 = en el proceso del bot)", [("", _procesos.n if _procesos else 0)])
+
+    gen = generacion_actual()
+    metrica("bot_db_generacion", "gauge", "Generación de la DB activa", [("", gen.numero if gen else 0)])
+    metrica("bot_db_filas", "gauge", "Filas de la generación activa", [("", gen.filas if gen else 0)])
+    metrica("bot_db_bytes", "gauge", "Tamaño del archivo de la generación activa", [("", gen.bytes if gen else 0)])
+    metrica("bot_db_indices_segundos", "gauge", "Duración de la última provisión de índices", [("", ULTIMA_CARGA.get("indices_s", 0))])
+    metrica("bot_db_refresco_segundos", "gauge", "Duración del último refresco", [("", ULTIMA_CARGA.get("refresco_s", 0))])
+    metrica("bot_db_refresco_timestamp", "gauge", "Fin del último refresco (epoch)", [("", ULTIMA_CARGA.get("refresco_ts", 0))])
+
+    bloqueo = sorted(BLOQUEO_LOOP.items())
+    metrica("bot_loop_bloqueo_segundos_total", "counter", "Tiempo que cada handler ocupó el event loop", [(f'{{comando="{n}"}}', st["total_s"]) for n, st in bloqueo])
+    metrica("bot_loop_bloqueo_max_segundos", "gauge", "Paso síncrono más largo por handler", [(f'{{comando="{n}"}}', st["max_s"]) for n, st in bloqueo])
+    return "\n".join(lineas) + "\n"
+
+async def metricas(request):
+    return web.Response(body=texto_metricas().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def iniciar_servidor(app_bot):
+    app = web.Application()
+    app["bot"] = app_bot
+    app.router.add_get("/", home)
+    app.router.add_get("/metrics", metricas)
+    if MODO == "webhook": app.router.add_post(WEBHOOK_RUTA, recibir_update)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    return runner
 
 # --- LOGGING ---
 logging.basicConfig(
@@ -46,206 +209,1271 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+# --- MÉTRICAS (PROMETHEUS) ---
+# Contadores e histogramas en memoria: en el camino caliente solo se suma bajo
+# un lock; el texto de /metrics se arma recién cuando alguien lo pide. El
+# handler en curso viaja en COMANDO (también a los hilos SQL) como etiqueta.
+COMANDO = contextvars.ContextVar("comando", default="-")
+USUARIO = contextvars.ContextVar("usuario", default=0)  # para el reparto justo de workers (sección WORKERS SQL)
+CUBETAS_SEG = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histograma:
+    def __init__(self, cubetas=CUBETAS_SEG):
+        self.cubetas = cubetas
+        self.cuentas = [0] * (len(cubetas) + 1)  # la última es +Inf
+        self.suma = 0.0
+
+LATENCIAS = {}   # (comando, fase) -> Histograma; fase: cola, sql, render, total
+CONTADORES = {}  # (métrica, etiqueta, valor) -> n
+_metricas_lock = threading.Lock()
+
+# observar("sql", 0.01, "render", 0.001): varias fases con una sola toma del lock
+def observar(*fases_y_segundos):
+    comando = COMANDO.get()
+    with _metricas_lock:
+        for i in range(0, len(fases_y_segundos), 2):
+            clave = (comando, fases_y_segundos[i])
+            h = LATENCIAS.get(clave) or LATENCIAS.setdefault(clave, Histograma())
+            segundos = fases_y_segundos[i + 1]
+            h.cuentas[bisect.bisect_left(h.cubetas, segundos)] += 1
+            h.suma += segundos
+
+def sumar(metrica, n=1, etiqueta="comando", valor=None):
+    clave = (metrica, etiqueta, valor if valor is not None else COMANDO.get())
+    with _metricas_lock: CONTADORES[clave] = CONTADORES.get(clave, 0) + n
+
 # --- 2. GESTIÓN BASE DE DATOS ---
-def descargar_db():
+# La descarga va por bloques a un temporal; solo si el tamaño, el checksum y
+# la cabecera SQLite son correctos queda lista para validarse y publicarse.
+CABECERA_SQLITE = b"SQLite format 3\x00"
+META_DB_LOCAL = NOMBRE_DB_LOCAL + ".meta.json"  # ETag / Last-Modified de la DB publicada
+COLUMNAS_REQUERIDAS = [COL_ID_PRINCIPAL, COL_APELLIDO, COL_NOMBRE, COL_DOMICILIO, COL_SEXO, COL_CLASE]
+
+def checksum_esperado():
+    if DB_SHA256: return DB_SHA256.strip().lower()
+    if DB_SHA256_URL:
+        r = requests.get(DB_SHA256_URL, allow_redirects=True, timeout=30)
+        r.raise_for_status()
+        return r.text.split()[0].lower()
+    return None
+
+# Resultados de descargar_db / actualizar_db
+DESCARGADA, SIN_CAMBIOS, FALLIDA = "descargada", "sin_cambios", "fallida"
+
+def leer_meta():
+    try:
+        with open(META_DB_LOCAL, encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def guardar_meta(meta):
+    with open(META_DB_LOCAL + ".tmp", 'w', encoding='utf-8') as f: json.dump(meta, f)
+    os.replace(META_DB_LOCAL + ".tmp", META_DB_LOCAL)
+
+# Si hay una generación publicada se pide con If-None-Match / If-Modified-Since:
+# un 304 evita bajar el archivo. Los validadores nuevos quedan en `meta` y se
+# guardan recién cuando la DB se publica.
+def descargar_db(destino, meta=None):
     if not DB_URL:
         logging.error("❌ Falta DB_URL")
-        return False
+        return FALLIDA
+    completa = False
     try:
-        r = requests.get(DB_URL, allow_redirects=True)
-        if r.status_code == 200:
-            with open(NOMBRE_DB_LOCAL, 'wb') as f:
-                f.write(r.content)
-            logging.info("✅ DB Descargada.")
-            return True
-        return False
+        cabeceras = {}
+        previa = leer_meta() if generacion_actual() is not None else {}
+        if previa.get('etag'): cabeceras['If-None-Match'] = previa['etag']
+        if previa.get('last_modified'): cabeceras['If-Modified-Since'] = previa['last_modified']
+
+        sha, escritos = hashlib.sha256(), 0
+        with requests.get(DB_URL, headers=cabeceras, allow_redirects=True, stream=True, timeout=(10, 60)) as r:
+            if r.status_code == 304:
+                logging.info("✅ DB sin cambios (304).")
+                return SIN_CAMBIOS
+            if r.status_code != 200:
+                logging.error(f"❌ Descarga HTTP {r.status_code}")
+                return FALLIDA
+            if meta is not None:
+                meta['etag'] = r.headers.get('ETag')
+                meta['last_modified'] = r.headers.get('Last-Modified')
+            esperado = checksum_esperado()
+            # Con Content-Encoding el largo es el comprimido: no sirve para validar
+            largo = None if r.headers.get('Content-Encoding') else r.headers.get('Content-Length')
+            with open(destino, 'wb') as f:
+                for bloque in r.iter_content(chunk_size=DB_CHUNK_BYTES):
+                    f.write(bloque)
+                    sha.update(bloque)
+                    escritos += len(bloque)
+                f.flush()
+                os.fsync(f.fileno())
+
+        if largo is not None and escritos != int(largo):
+            logging.error(f"❌ Descarga incompleta: {escritos} de {largo} bytes")
+            return FALLIDA
+        if esperado and sha.hexdigest() != esperado:
+            logging.error(f"❌ Checksum distinto: {sha.hexdigest()} != {esperado}")
+            return FALLIDA
+        with open(destino, 'rb') as f:
+            if f.read(len(CABECERA_SQLITE)) != CABECERA_SQLITE:
+                logging.error("❌ Lo descargado no es una DB SQLite")
+                return FALLIDA
+
+        logging.info(f"✅ DB Descargada ({escritos / 1024 / 1024:.1f} MB, sha256 {sha.hexdigest()[:12]}).")
+        completa = True
+        return DESCARGADA
     except Exception as e:
         logging.error(f"❌ Error descarga: {e}")
-        return False
+        return FALLIDA
+    finally:
+        if not completa and os.path.exists(destino): os.remove(destino)
 
-# --- 3. MOTORES DE BÚSQUEDA ---
+def abrir_conexion_lectura(ruta):
+    uri = pathlib.Path(ruta).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+    conn.execute(f"PRAGMA cache_size = -{DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_BYTES}")
+    conn.execute("PRAGMA query_only = 1")
+    if LENTA_MS > 0 or BUSQUEDA_MAX_MS > 0 or BUSQUEDA_MAX_PASOS > 0:
+        conn.set_progress_handler(_traza_pasos, DB_PASOS_AVISO)
+    return conn
 
-# A. Búsqueda Simple (Una sola columna)
-def obtener_datos_paginados(columna, valor, pagina=0):
-    if not os.path.exists(NOMBRE_DB_LOCAL): return "⚠️ Cargando DB...", False
+# Antes de publicar una DB nueva se comprueba que sirva: columnas COL_*,
+# PRAGMA quick_check y que la cantidad de filas no se desplome.
+def validar_db(ruta, filas_previas=None):
+    conn = abrir_conexion_lectura(ruta)
     try:
-        conn = sqlite3.connect(NOMBRE_DB_LOCAL)
-        cursor = conn.cursor()
-        
-        q_count = f"SELECT COUNT(*) FROM {NOMBRE_TABLA} WHERE {columna} LIKE ? COLLATE NOCASE"
-        cursor.execute(q_count, (f"%{valor}%",))
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            conn.close()
-            return f"❌ Nada en {columna} para '{valor}'.", False
-        
-        paginas_tot = math.ceil(total / RESULTADOS_POR_PAGINA)
-        offset = pagina * RESULTADOS_POR_PAGINA
-        
-        q_data = f"SELECT * FROM {NOMBRE_TABLA} WHERE {columna} LIKE ? COLLATE NOCASE LIMIT {RESULTADOS_POR_PAGINA} OFFSET {offset}"
-        cursor.execute(q_data, (f"%{valor}%",))
-        filas = cursor.fetchall()
-        headers = [d[0] for d in cursor.description]
+        columnas = {fila[1].lower() for fila in conn.execute(f"PRAGMA table_info({NOMBRE_TABLA})")}
+        faltan = [c for c in COLUMNAS_REQUERIDAS + COLUMNAS_MOSTRAR if c.lower() not in columnas]
+        if faltan:
+            raise ValueError(f"faltan columnas en {NOMBRE_TABLA}: {faltan}")
+        chequeo = conn.execute("PRAGMA quick_check").fetchone()[0]
+        if chequeo != 'ok':
+            raise ValueError(f"quick_check: {chequeo}")
+        filas = conn.execute(f"SELECT COUNT(*) FROM {NOMBRE_TABLA}").fetchone()[0]
+        if filas == 0:
+            raise ValueError(f"{NOMBRE_TABLA} está vacía")
+        if filas_previas and filas < filas_previas * (1 - DB_CAIDA_MAX_FILAS):
+            raise ValueError(f"{filas} filas contra {filas_previas} de la generación anterior")
+        return filas
+    finally:
         conn.close()
 
-        mensaje = f"🔎 **'{valor}'** (Pág {pagina + 1}/{paginas_tot}):\n"
-        for fila in filas:
-            mensaje += "\n➖➖➖➖➖\n"
-            for i in range(len(headers)):
-                d = str(fila[i])
-                if d and d.lower() not in ['nan', 'none', '']:
-                    mensaje += f"🔹 *{headers[i]}:* {d}\n"
-        
-        return mensaje, (pagina + 1) < paginas_tot
-    except Exception as e:
-        return f"⚠️ Error: {e}", False
+# Índices que necesitan los motores, con la misma colación que las consultas.
+# Se crean sobre el archivo aún no publicado y después se corre ANALYZE para
+# que el planificador tenga estadísticas.
+INDICES = {
+    f"idx_{NOMBRE_TABLA}_sexo_clase":     f'"{COL_SEXO}" COLLATE NOCASE, "{COL_CLASE}" COLLATE NOCASE',
+    f"idx_{NOMBRE_TABLA}_{COL_ID_PRINCIPAL}": f'"{COL_ID_PRINCIPAL}"',
+    f"idx_{NOMBRE_TABLA}_{COL_APELLIDO}": f'"{COL_APELLIDO}" COLLATE NOCASE',
+    f"idx_{NOMBRE_TABLA}_{COL_NOMBRE}":   f'"{COL_NOMBRE}" COLLATE NOCASE',
+}
+ULTIMA_CARGA = {}  # tiempos de la última publicación
 
-# B. Búsqueda Finder (Sexo + Clase + Domicilio)
-def obtener_datos_combinados(sexo, clase, domicilio, pagina=0):
-    if not os.path.exists(NOMBRE_DB_LOCAL): return "⚠️ Cargando DB...", False
+# Tabla FTS5 trigram de contenido externo sobre las columnas de texto. Los
+# triggers la mantienen al día cuando los deltas tocan la tabla.
+TABLA_FTS = f"{NOMBRE_TABLA}_fts"
+COLUMNAS_FTS = [COL_APELLIDO, COL_NOMBRE, COL_DOMICILIO]
+
+def crear_fts(conn):
+    cols = ", ".join(f'"{c}"' for c in COLUMNAS_FTS)
+    nuevos = ", ".join(f'new."{c}"' for c in COLUMNAS_FTS)
+    viejos = ", ".join(f'old."{c}"' for c in COLUMNAS_FTS)
+    conn.execute(f"CREATE VIRTUAL TABLE {TABLA_FTS} USING fts5({cols}, content='{NOMBRE_TABLA}', content_rowid='rowid', tokenize='trigram')")
+    conn.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES ('rebuild')")
+    conn.execute(f"""CREATE TRIGGER {TABLA_FTS}_ai AFTER INSERT ON {NOMBRE_TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}(rowid, {cols}) VALUES (new.rowid, {nuevos}); END""")
+    conn.execute(f"""CREATE TRIGGER {TABLA_FTS}_ad AFTER DELETE ON {NOMBRE_TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {cols}) VALUES ('delete', old.rowid, {viejos}); END""")
+    conn.execute(f"""CREATE TRIGGER {TABLA_FTS}_au AFTER UPDATE ON {NOMBRE_TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, {cols}) VALUES ('delete', old.rowid, {viejos});
+        INSERT INTO {TABLA_FTS}(rowid, {cols}) VALUES (new.rowid, {nuevos}); END""")
+
+def provisionar_indices(ruta):
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(ruta)
     try:
-        conn = sqlite3.connect(NOMBRE_DB_LOCAL)
-        cursor = conn.cursor()
-        
-        condicion = f"{COL_SEXO} = ? COLLATE NOCASE AND {COL_CLASE} = ? COLLATE NOCASE AND {COL_DOMICILIO} LIKE ? COLLATE NOCASE"
-        params = (sexo, clase, f"%{domicilio}%")
+        # Las conexiones mode=ro no pueden crear el -shm de una DB en WAL
+        conn.execute("PRAGMA journal_mode = DELETE")
+        existentes = {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master")}
+        creados = [nombre for nombre in INDICES if nombre not in existentes]
+        for nombre in creados:
+            conn.execute(f'CREATE INDEX "{nombre}" ON {NOMBRE_TABLA} ({INDICES[nombre]})')
+        if FTS_TRIGRAMA and TABLA_FTS not in existentes:
+            try:
+                crear_fts(conn)
+                creados.append(TABLA_FTS)
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                logging.warning(f"⚠️ Sin índice FTS5 trigram ({e}), las búsquedas seguirán con LIKE.")
+        if creados or "sqlite_stat1" not in existentes:
+            conn.execute(f"PRAGMA analysis_limit = {DB_ANALYZE_LIMITE}")
+            conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+    duracion = time.perf_counter() - t0
+    logging.info(f"🗂️ Índices listos en {duracion:.1f}s ({len(creados)} creados).")
+    return duracion
 
-        cursor.execute(f"SELECT COUNT(*) FROM {NOMBRE_TABLA} WHERE {condicion}", params)
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            conn.close()
-            return f"❌ Sin resultados Finder.", False
-            
-        paginas_tot = math.ceil(total / RESULTADOS_POR_PAGINA)
-        offset = pagina * RESULTADOS_POR_PAGINA
-        
-        q_data = f"SELECT * FROM {NOMBRE_TABLA} WHERE {condicion} LIMIT {RESULTADOS_POR_PAGINA} OFFSET {offset}"
-        cursor.execute(q_data, params)
-        filas = cursor.fetchall()
-        headers = [d[0] for d in cursor.description]
+# Cada DB publicada es una generación con su propio pool de conexiones de
+# solo lectura, abiertas (y precalentadas) sobre el archivo ya validado. Al
+# reemplazar el archivo, las conexiones siguen apuntando al inode que
+# validaron: las consultas en curso terminan sobre la generación vieja y sus
+# conexiones se cierran al devolverse. Quien pida una conexión a una
+# generación ya retirada recibe GeneracionRetirada (y reintenta sobre la
+# actual) en vez de esperar una que nunca vuelve.
+class GeneracionRetirada(Exception):
+    pass
+
+class GeneracionDB:
+    def __init__(self, numero, ruta, filas, tamano=DB_POOL_TAMANO):
+        self.numero = numero
+        self.filas = filas
+        self.bytes = os.path.getsize(ruta)
+        self.version = None  # PRAGMA user_version, lo usan los deltas
+        self.fts = False     # hay índice trigram para enrutar los LIKE
+        self._libres = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._abiertas = 0
+        self._retirada = False
+        for _ in range(max(1, tamano)):
+            conn = abrir_conexion_lectura(ruta)
+            conn.execute(f"SELECT * FROM {NOMBRE_TABLA} LIMIT 1").fetchall()
+            self.version = conn.execute("PRAGMA user_version").fetchone()[0]
+            self.fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (TABLA_FTS,)).fetchone() is not None
+            self._libres.put(conn)
+            self._abiertas += 1
+
+    @contextmanager
+    def prestar(self):
+        conn = self._libres.get()
+        if conn is None:
+            self._libres.put(None)  # para el próximo que esté esperando
+            raise GeneracionRetirada(self.numero)
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if self._retirada: self._cerrar(conn)
+                else: self._libres.put(conn)
+
+    def _cerrar(self, conn):
         conn.close()
+        self._abiertas -= 1
+        if self._abiertas == 0:
+            logging.info(f"♻️ Generación {self.numero} liberada.")
 
-        mensaje = f"🎯 **Finder** (Pág {pagina + 1}/{paginas_tot}):\n"
-        for fila in filas:
-            mensaje += "\n➖➖➖➖➖\n"
-            for i in range(len(headers)):
-                d = str(fila[i])
-                if d and d.lower() not in ['nan', 'none', '']:
-                    mensaje += f"🔹 *{headers[i]}:* {d}\n"
-        
-        return mensaje, (pagina + 1) < paginas_tot
-    except Exception as e:
-        return f"⚠️ Error Finder: {e}", False
+    def retirar(self):
+        with self._lock:
+            self._retirada = True
+            while True:
+                try: self._cerrar(self._libres.get_nowait())
+                except queue.Empty: break
+            self._libres.put(None)  # despierta a los que esperan conexión
 
-# C. Búsqueda Persona (Apellido + Nombre)
-def obtener_datos_persona(apellido, nombre, pagina=0):
-    if not os.path.exists(NOMBRE_DB_LOCAL): return "⚠️ Cargando DB...", False
+_generacion = None
+_carga_lock = threading.Lock()  # una sola carga/publicación a la vez
+
+def generacion_actual():
+    return _generacion
+
+# Valida `ruta`, le crea los índices, abre su generación y recién entonces la publica: renombra
+# sobre NOMBRE_DB_LOCAL y mueve el puntero. Si algo falla sigue la anterior.
+# Con procesos SQL, todos abren la generación nueva antes del cambio y la
+# activan juntos después (ver ProcesosSQL); acá solo queda una conexión.
+def publicar_db(ruta):
+    global _generacion
+    with _carga_lock:
+        previa = _generacion
+        nueva = None
+        try:
+            filas = validar_db(ruta, previa.filas if previa else None)
+            ULTIMA_CARGA['indices_s'] = provisionar_indices(ruta)
+            nueva = GeneracionDB(previa.numero + 1 if previa else 1, ruta, filas, 1 if _procesos else DB_POOL_TAMANO)
+            if _procesos is not None: _procesos.preparar(nueva.numero, os.path.abspath(ruta), filas)
+        except Exception as e:
+            if nueva is not None: nueva.retirar()
+            logging.error(f"❌ DB rechazada, sigue la generación {previa.numero if previa else '-'}: {e}")
+            return False
+        # Si el rename falla, los procesos SQL ya tienen `nueva` abierta y el
+        # cambio tomado: se descarta y siguen con la previa
+        try:
+            if os.path.abspath(ruta) != os.path.abspath(NOMBRE_DB_LOCAL):
+                os.replace(ruta, NOMBRE_DB_LOCAL)
+        except Exception as e:
+            if _procesos is not None: _procesos.descartar()
+            nueva.retirar()
+            logging.error(f"❌ No se pudo mover la DB, sigue la generación {previa.numero if previa else '-'}: {e}")
+            return False
+        _generacion = nueva
+        if _procesos is not None: _procesos.activar(nueva.numero, filas)
+        if previa is not None: previa.retirar()
+        # Las claves llevan la generación; limpiar solo libera memoria
+        CACHE_TOTALES.limpiar()
+        CACHE_PAGINAS.limpiar()
+        logging.info(f"🔁 Generación {nueva.numero} activa ({filas} filas).")
+        return True
+
+# Deltas: junto a la DB completa el origen publica un manifiesto
+#   {"version": N, "deltas": [{"desde": 7, "hasta": 8, "url": "...", "sha256": "..."}]}
+# donde la versión es el PRAGMA user_version de la DB completa. Cada delta es
+# JSON (opcionalmente gzip) con cambios a nivel de fila:
+#   {"clave": "id", "borrar": [claves], "upsert": [{columna: valor, ...}]}
+# Cada fila de "upsert" trae la clave y solo las columnas que cambian: si la
+# clave ya existe se actualizan esas columnas (las demás quedan como están);
+# si no, se inserta la fila y lo que no venga queda NULL.
+# Se aplican sobre una copia de la DB publicada y esa copia sigue el mismo
+# camino de validación y publicación que una descarga completa.
+def bajar_json(url, sha=None):
+    r = requests.get(url, allow_redirects=True, timeout=(10, 60))
+    r.raise_for_status()
+    datos = r.content
+    if sha and hashlib.sha256(datos).hexdigest() != sha.lower():
+        raise ValueError(f"checksum distinto en {url}")
+    if datos[:2] == b"\x1f\x8b": datos = gzip.decompress(datos)
+    return json.loads(datos)
+
+def cadena_deltas(manifiesto, desde):
+    por_origen = {d['desde']: d for d in manifiesto.get('deltas', [])}
+    cadena = []
+    while desde != manifiesto['version']:
+        paso = por_origen.get(desde)
+        if paso is None or paso['hasta'] <= desde: return None
+        cadena.append(paso)
+        desde = paso['hasta']
+    return cadena
+
+def aplicar_delta(conn, delta, columnas):
+    clave = delta.get('clave', COL_ID_PRINCIPAL)
+    for col in [clave] + [c for fila in delta.get('upsert', []) for c in fila]:
+        if col.lower() not in columnas: raise ValueError(f"columna desconocida en delta: {col}")
+    # La clave se busca por igualdad exacta: si INDICES no tiene ya ese mismo
+    # índice, va con nombre propio para no tapar (por nombre) uno de INDICES
+    indice = f"idx_{NOMBRE_TABLA}_{clave}"
+    if INDICES.get(indice, f'"{clave}"') != f'"{clave}"': indice = f"idx_{NOMBRE_TABLA}_delta_{clave}"
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{indice}" ON {NOMBRE_TABLA} ("{clave}")')
+    borrar = f'DELETE FROM {NOMBRE_TABLA} WHERE "{clave}" = ?'
+    conn.executemany(borrar, ([k] for k in delta.get('borrar', [])))
+    for fila in delta.get('upsert', []):
+        if clave not in fila: raise ValueError(f"fila de upsert sin la clave {clave}")
+        cambios = [c for c in fila if c != clave]
+        if cambios:
+            asignaciones = ", ".join(f'"{c}" = ?' for c in cambios)
+            cursor = conn.execute(f'UPDATE {NOMBRE_TABLA} SET {asignaciones} WHERE "{clave}" = ?', [fila[c] for c in cambios] + [fila[clave]])
+            if cursor.rowcount: continue
+        elif conn.execute(f'SELECT 1 FROM {NOMBRE_TABLA} WHERE "{clave}" = ?', [fila[clave]]).fetchone():
+            continue
+        nombres = ", ".join(f'"{c}"' for c in fila)
+        conn.execute(f"INSERT INTO {NOMBRE_TABLA} ({nombres}) VALUES ({', '.join('?' * len(fila))})", list(fila.values()))
+
+def actualizar_por_deltas(nueva):
+    gen = generacion_actual()
+    manifiesto = bajar_json(DB_DELTAS_URL)
+    if manifiesto['version'] == gen.version:
+        logging.info(f"✅ DB sin cambios (versión {gen.version}).")
+        return SIN_CAMBIOS
+    cadena = cadena_deltas(manifiesto, gen.version)
+    if cadena is None:
+        logging.warning(f"⚠️ Sin cadena de deltas de la versión {gen.version} a la {manifiesto['version']}")
+        return FALLIDA
+
+    shutil.copyfile(NOMBRE_DB_LOCAL, nueva)
+    conn = sqlite3.connect(nueva)
+    try:
+        columnas = {fila[1].lower() for fila in conn.execute(f"PRAGMA table_info({NOMBRE_TABLA})")}
+        with conn:
+            for paso in cadena:
+                aplicar_delta(conn, bajar_json(urljoin(DB_DELTAS_URL, paso['url']), paso.get('sha256')), columnas)
+            conn.execute(f"PRAGMA user_version = {int(manifiesto['version'])}")
+    finally:
+        conn.close()
+    logging.info(f"✅ {len(cadena)} delta(s) aplicados: versión {gen.version} -> {manifiesto['version']}.")
+    return DESCARGADA
+
+_actualizacion_lock = threading.Lock()  # /actualizar y el refresco programado no se pisan
+
+def actualizar_db():
+    t0 = time.monotonic()
+    estado = _actualizar_db()
+    ULTIMA_CARGA.update(refresco_s=time.monotonic() - t0, refresco_ts=time.time())
+    sumar("bot_refrescos_total", etiqueta="resultado", valor=estado)
+    return estado
+
+def _actualizar_db():
+    nueva = NOMBRE_DB_LOCAL + ".nueva"
+    with _actualizacion_lock:
+        try:
+            if DB_DELTAS_URL and generacion_actual() is not None:
+                try:
+                    estado = actualizar_por_deltas(nueva)
+                except Exception as e:
+                    logging.error(f"❌ Error aplicando deltas: {e}")
+                    estado = FALLIDA
+                if estado == SIN_CAMBIOS: return estado
+                if estado == DESCARGADA and publicar_db(nueva):
+                    guardar_meta({})  # los validadores HTTP de DB_URL ya no describen el archivo local
+                    return estado
+                logging.warning("⚠️ Deltas no aplicables, se baja la DB completa.")
+                if os.path.exists(nueva): os.remove(nueva)
+            meta = {}
+            estado = descargar_db(nueva, meta)
+            if estado != DESCARGADA: return estado
+            if not publicar_db(nueva): return FALLIDA
+            guardar_meta(meta)
+            return DESCARGADA
+        finally:
+            if os.path.exists(nueva): os.remove(nueva)
+
+# Refresco en segundo plano con el job queue del bot. El intervalo lleva
+# jitter para no sincronizarse con otras réplicas; tras un fallo se reintenta
+# antes, duplicando la espera hasta volver al intervalo normal.
+def programar_refresco(job_queue, fallos=0):
+    intervalo = DB_REFRESCO_MIN * 60
+    espera = min(intervalo, DB_REINTENTO_SEG * 2 ** (fallos - 1)) if fallos else intervalo
+    espera *= random.uniform(1 - DB_REFRESCO_JITTER, 1 + DB_REFRESCO_JITTER)
+    job_queue.run_once(refresco_programado, espera, data=fallos, name="refresco_db")
+
+async def refresco_programado(context):
     try:
-        conn = sqlite3.connect(NOMBRE_DB_LOCAL)
-        cursor = conn.cursor()
-        
-        condicion = f"{COL_APELLIDO} LIKE ? COLLATE NOCASE AND {COL_NOMBRE} LIKE ? COLLATE NOCASE"
-        params = (f"%{apellido}%", f"%{nombre}%")
+        estado = await asyncio.to_thread(actualizar_db)
+    except Exception as e:  # p. ej. OSError al renombrar o guardar la meta: igual se reprograma
+        logging.error(f"❌ Error en el refresco automático: {e}")
+        estado = FALLIDA
+    fallos = context.job.data + 1 if estado == FALLIDA else 0
+    if fallos: logging.warning(f"⚠️ Refresco automático fallido ({fallos} seguidos)")
+    programar_refresco(context.job_queue, fallos)
+
+# --- 3. MOTORES DE BÚSQUEDA ---
+
+# LRU con vencimiento, tope de entradas y de bytes (estimados con
+# sys.getsizeof). Segura entre hilos: la usan los workers SQL.
+def tamano_aprox(obj):
+    if isinstance(obj, (tuple, list)): return sys.getsizeof(obj) + sum(tamano_aprox(x) for x in obj)
+    return sys.getsizeof(obj)
+
+class CacheLRU:
+    def __init__(self, max_entradas, max_bytes, ttl):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._datos = OrderedDict()  # clave -> (valor, vence, bytes)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[1] < time.monotonic():
+                if entrada is not None: self._quitar(clave)
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, valor, tam=None):
+        if tam is None: tam = tamano_aprox(clave) + tamano_aprox(valor)
+        if tam > self.max_bytes: return
+        with self._lock:
+            if clave in self._datos: self._quitar(clave)
+            self._datos[clave] = (valor, time.monotonic() + self.ttl, tam)
+            self.bytes += tam
+            while len(self._datos) > self.max_entradas or self.bytes > self.max_bytes:
+                self._quitar(next(iter(self._datos)))
+
+    def _quitar(self, clave):
+        self.bytes -= self._datos.pop(clave)[2]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self.bytes = 0
+
+    # Aciertos y fallos desde la última llamada (los procesos SQL los pasan al bot)
+    def tomar_contadores(self):
+        with self._lock:
+            contadores, self.aciertos, self.fallos = (self.aciertos, self.fallos), 0, 0
+        return contadores
+
+    def sumar_contadores(self, aciertos, fallos):
+        with self._lock:
+            self.aciertos += aciertos
+            self.fallos += fallos
+
+    def __len__(self):
+        return len(self._datos)
 
-        cursor.execute(f"SELECT COUNT(*) FROM {NOMBRE_TABLA} WHERE {condicion}", params)
+# Totales por (generación, filtro, parámetros): las páginas siguientes de una
+# misma búsqueda no vuelven a contar. Un total exacto reemplaza al acotado.
+CACHE_TOTALES = CacheLRU(CACHE_TOTALES_MAX, CACHE_TOTALES_MB * 1024 * 1024, CACHE_TOTALES_TTL)
+
+# Texto libre = ID casi siempre. Si es una clave numérica completa se prueba
+# primero la igualdad (índice de COL_ID_PRINCIPAL; como int y como texto por
+# la afinidad de la columna) y solo si no aparece se cae al LIKE.
+RUTAS_ID = {'exacta': 0, 'substring': 0}  # cuántas búsquedas de ID resolvió cada camino
+_rutas_lock = threading.Lock()
+
+def contar_ruta_id(ruta):
+    with _rutas_lock: RUTAS_ID[ruta] += 1
+
+# Solo se leen de SQLite las columnas que se van a mostrar
+PROYECCION = ", ".join(f'"{c}"' for c in COLUMNAS_MOSTRAR) or "*"
+PROYECCION_FTS = ", ".join(f'm."{c}"' for c in COLUMNAS_MOSTRAR) or "m.*"  # con la tabla como `m`
+ORIGEN_FTS = f"{TABLA_FTS} f JOIN {NOMBRE_TABLA} m ON m.rowid = f.rowid"
+
+# Todas las sentencias de una condición, armadas una sola vez. Como el texto
+# SQL no cambia entre llamadas (LIMIT/OFFSET y cursores van como parámetros),
+# cada conexión reutiliza la sentencia preparada de su caché.
+class Consulta:
+    def __init__(self, condicion, origen=NOMBRE_TABLA, rowid="rowid", proyeccion=PROYECCION):
+        self.condicion = condicion
+        base = f"SELECT {rowid}, {proyeccion} FROM {origen} WHERE ({condicion})"
+        self.contar_exacto  = f"SELECT COUNT(*) FROM {origen} WHERE {condicion}"
+        self.contar_acotado = f"SELECT COUNT(*) FROM (SELECT 1 FROM {origen} WHERE {condicion} LIMIT ?)"
+        self.primera = f"{base} ORDER BY {rowid} LIMIT ? OFFSET ?"
+        self.despues = f"{base} AND {rowid} > ? ORDER BY {rowid} LIMIT ?"
+        self.misma   = f"{base} AND {rowid} >= ? ORDER BY {rowid} LIMIT ?"
+        self.antes   = f"{base} AND {rowid} < ? ORDER BY {rowid} DESC LIMIT ?"
+
+# Largo del trozo más largo sin comodines de LIKE
+def largo_literal(valor):
+    return max(len(trozo) for trozo in valor.replace("_", "%").split("%"))
+
+# Especificación declarativa de una búsqueda: filtros (columna, '=' o 'like')
+# en el orden de los valores que recibe, y los textos de la respuesta (con
+# {0}, {1}... para los valores). Si ningún '=' acota ya por índice, los LIKE
+# con FTS_MIN_CHARS letras seguidas van por el índice trigram: se recorre la
+# tabla FTS5 en orden de rowid unida a la tabla (LIMIT corta enseguida) y el
+# LIKE original se aplica igual sobre cada fila.
+class EspecBusqueda:
+    def __init__(self, nombre, filtros, titulo, vacio, error, clave_exacta=False):
+        self.nombre = nombre
+        self.filtros = filtros
+        self.titulo = titulo
+        self.vacio = vacio
+        self.error = error
+        self.clave_exacta = clave_exacta  # probar antes COL_ID_PRINCIPAL = valor
+        self.con_igualdad = any(op == '=' for _, op in filtros)
+        self._consultas = {}  # variante (índices de los filtros que van por FTS) -> Consulta
+        self.exacta = Consulta(f"{COL_ID_PRINCIPAL} IN (?, ?)")
+
+    def variante_fts(self, gen, valores):
+        if not gen.fts or self.con_igualdad: return ()
+        return tuple(i for i, ((col, op), v) in enumerate(zip(self.filtros, valores))
+                     if op == 'like' and col in COLUMNAS_FTS and largo_literal(v) >= FTS_MIN_CHARS)
+
+    def consulta(self, gen, valores):
+        variante = self.variante_fts(gen, valores)
+        consulta = self._consultas.get(variante)
+        if consulta is None:
+            partes = []
+            m = "m." if variante else ""
+            for i, (col, op) in enumerate(self.filtros):
+                if op == '=': partes.append(f"{m}{col} = ? COLLATE NOCASE")
+                elif i in variante: partes.append(f'f."{col}" LIKE ? AND m."{col}" LIKE ? COLLATE NOCASE')
+                else: partes.append(f"{m}{col} LIKE ? COLLATE NOCASE")
+            if variante: consulta = Consulta(" AND ".join(partes), ORIGEN_FTS, "f.rowid", PROYECCION_FTS)
+            else: consulta = Consulta(" AND ".join(partes))
+            self._consultas[variante] = consulta
+        params = []
+        for i, ((col, op), v) in enumerate(zip(self.filtros, valores)):
+            if op == '=': params.append(v)
+            elif i in variante: params += [f"%{v}%", f"%{v}%"]
+            else: params.append(f"%{v}%")
+        return consulta, params
+
+# La búsqueda simple lleva la columna en el botón: solo se aceptan las COL_*
+_especs_simples = {}
+
+def espec_simple(columna):
+    if columna not in COLUMNAS_REQUERIDAS: raise ValueError(f"columna no buscable: {columna}")
+    espec = _especs_simples.get(columna)
+    if espec is None:
+        espec = _especs_simples[columna] = EspecBusqueda(
+            'simple', [(columna, 'like')], "🔎 **'{0}'**", f"❌ Nada en {columna} para '{{0}}'.", "⚠️ Error",
+            clave_exacta=(columna == COL_ID_PRINCIPAL))
+    return espec
+
+ESPEC_FINDER = EspecBusqueda('finder', [(COL_SEXO, '='), (COL_CLASE, '='), (COL_DOMICILIO, 'like')],
+                             "🎯 **Finder**", "❌ Sin resultados Finder.", "⚠️ Error Finder")
+ESPEC_PERSONA = EspecBusqueda('persona', [(COL_APELLIDO, 'like'), (COL_NOMBRE, 'like')],
+                              "👤 **{0}, {1}**", "❌ Nadie con Apellido '{0}' y Nombre '{1}'.", "⚠️ Error Persona")
+ESPEC_ASC = EspecBusqueda('asc', [(COL_SEXO, '='), (COL_CLASE, '='), (COL_APELLIDO, 'like')],
+                          "🧬 **ASC: {0}|{1}|{2}**", "❌ Sin resultados ASC.", "⚠️ Error ASC")
+
+# El total se cuenta con tope: pasado CONTEO_MAX se deja de contar y se
+# muestra "más de N". Exacto solo si es barato (igualdad indexada) o si se
+# pidió con el botón "🔢 Total exacto" (cursor '=N').
+def contar(gen, cursor, consulta, params, exacto=False):
+    clave = (gen.numero, consulta.condicion, tuple(params))
+    previo = CACHE_TOTALES.obtener(clave)
+    if previo is not None and (previo[1] or not exacto):
+        return previo
+    if exacto or CONTEO_MAX <= 0:
+        ejecutar_sql(cursor, consulta.contar_exacto, params)
+        resultado = (cursor.fetchone()[0], True)
+        sumar("bot_filas_contadas_total", resultado[0])
+    else:
+        ejecutar_sql(cursor, consulta.contar_acotado, params + [CONTEO_MAX + 1])
         total = cursor.fetchone()[0]
-        
-        if total == 0:
-            conn.close()
-            return f"❌ Nadie con Apellido '{apellido}' y Nombre '{nombre}'.", False
-            
-        paginas_tot = math.ceil(total / RESULTADOS_POR_PAGINA)
-        offset = pagina * RESULTADOS_POR_PAGINA
-        
-        q_data = f"SELECT * FROM {NOMBRE_TABLA} WHERE {condicion} LIMIT {RESULTADOS_POR_PAGINA} OFFSET {offset}"
-        cursor.execute(q_data, params)
+        resultado = (min(total, CONTEO_MAX), total <= CONTEO_MAX)
+        sumar("bot_filas_contadas_total", total)
+    CACHE_TOTALES.guardar(clave, resultado)
+    return resultado
+
+def rotulo_paginas(pagina, total, exacto):
+    if exacto: return f"Pág {pagina + 1}/{math.ceil(total / RESULTADOS_POR_PAGINA)}"
+    return f"Pág {pagina + 1}, más de {total} resultados"
+
+# Paginación por clave (rowid): cada página sigue desde el último rowid de la
+# anterior ('>N') o, hacia atrás, desde el primero ('<N'), así el costo no
+# crece con el número de página. '=N' repite la página que empieza en N. Se
+# pide una fila de más para saber si hay página siguiente sin otra consulta.
+# Sin cursor (p. ej. botones de una versión anterior) se usa OFFSET.
+def leer_pagina(cursor, consulta, params, pagina, desde):
+    n = RESULTADOS_POR_PAGINA
+    if desde and desde[0] == '<':
+        ejecutar_sql(cursor, consulta.antes, params + [int(desde[1:]), n])
+        filas = cursor.fetchall()[::-1]
+        tiene_mas = True  # la página desde la que se volvió
+    else:
+        if desde and desde[0] == '=': ejecutar_sql(cursor, consulta.misma, params + [int(desde[1:]), n + 1])
+        elif desde: ejecutar_sql(cursor, consulta.despues, params + [int(desde[1:]), n + 1])
+        else: ejecutar_sql(cursor, consulta.primera, params + [n + 1, pagina * n])
         filas = cursor.fetchall()
-        headers = [d[0] for d in cursor.description]
-        conn.close()
+        tiene_mas = len(filas) > n
+        filas = filas[:n]
+    headers = tuple(d[0] for d in cursor.description[1:])
+    limites = (filas[0][0], filas[-1][0]) if filas else None
+    return [fila[1:] for fila in filas], headers, tiene_mas, limites
+
+# Registro de búsquedas lentas y presupuesto por búsqueda. Las sentencias de
+# los motores pasan por ejecutar_sql, que las anota (hasta
+# LENTA_SENTENCIAS_MAX) mientras el hilo tiene una Traza activa; las que FTS5
+# corre por dentro no cuentan. Cada conexión del pool tiene además un
+# progress handler que cuenta pasos de la VM cada DB_PASOS_AVISO
+# instrucciones. Si la búsqueda pasa BUSQUEDA_MAX_MS o BUSQUEDA_MAX_PASOS, el
+# progress handler la interrumpe (el worker queda libre enseguida). Si supera
+# LENTA_MS se guarda en un buffer circular con el EXPLAIN QUERY PLAN de cada
+# sentencia, sacado de la misma conexión antes de devolverla. De los valores
+# buscados solo queda la forma (tipo y largo), nunca el contenido.
+CONSULTAS_LENTAS = deque(maxlen=LENTAS_MAX)
+_traza_local = threading.local()
 
-        mensaje = f"👤 **{apellido}, {nombre}** (Pág {pagina + 1}/{paginas_tot}):\n"
-        for fila in filas:
-            mensaje += "\n➖➖➖➖➖\n"
-            for i in range(len(headers)):
-                d = str(fila[i])
-                if d and d.lower() not in ['nan', 'none', '']:
-                    mensaje += f"🔹 *{headers[i]}:* {d}\n"
-        
-        return mensaje, (pagina + 1) < paginas_tot
+class Traza:
+    def __init__(self, limite=None):
+        self.pasos = 0
+        self.sentencias = []  # (sql, parámetros, inicio, pasos al inicio)
+        self.omitidas = 0     # pasado LENTA_SENTENCIAS_MAX
+        self.fin = None
+        self.limite = limite  # perf_counter máximo
+        self.cortada = False
+
+def ejecutar_sql(cursor, sql, params):
+    traza = getattr(_traza_local, "traza", None)
+    if traza is not None:
+        if len(traza.sentencias) < LENTA_SENTENCIAS_MAX: traza.sentencias.append((sql, params, time.perf_counter(), traza.pasos))
+        else: traza.omitidas += 1
+    return cursor.execute(sql, params)
+
+def _traza_pasos():
+    traza = getattr(_traza_local, "traza", None)
+    if traza is None: return 0
+    traza.pasos += DB_PASOS_AVISO
+    if (BUSQUEDA_MAX_PASOS and traza.pasos > BUSQUEDA_MAX_PASOS) or (traza.limite and time.perf_counter() > traza.limite):
+        traza.cortada = True
+        return 1  # SQLite aborta la sentencia con "interrupted"
+    return 0
+
+def forma_valor(valor):
+    if isinstance(valor, str): return f"texto[{len(valor)}]"
+    return "real" if isinstance(valor, float) else "entero"
+
+# `conn` es la conexión prestada a la búsqueda: el registro de la lenta la usa
+# antes de que vuelva al pool (o se cierre, si la generación se retiró)
+@contextmanager
+def trazar(gen, espec, conn):
+    if LENTA_MS <= 0 and BUSQUEDA_MAX_MS <= 0 and BUSQUEDA_MAX_PASOS <= 0:
+        yield None
+        return
+    t0 = time.perf_counter()
+    traza = _traza_local.traza = Traza(t0 + BUSQUEDA_MAX_MS / 1000 if BUSQUEDA_MAX_MS > 0 else None)
+    try:
+        yield traza
+    finally:
+        _traza_local.traza = None
+        traza.fin = time.perf_counter()
+        if LENTA_MS > 0 and (traza.fin - t0) * 1000 >= LENTA_MS: registrar_lenta(gen, espec, traza, traza.fin - t0, conn)
+
+def registrar_lenta(gen, espec, traza, segundos, conn):
+    try:
+        sentencias = []
+        for i, (sql, params, inicio, pasos) in enumerate(traza.sentencias):
+            fin, pasos_fin = traza.sentencias[i + 1][2:] if i + 1 < len(traza.sentencias) else (traza.fin, traza.pasos)
+            try: plan = [fila[3] for fila in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+            except sqlite3.Error as e: plan = [f"(sin plan: {e})"]
+            sentencias.append({"sql": sql, "formas": [forma_valor(v) for v in params], "ms": round((fin - inicio) * 1000, 1),
+                               "pasos": pasos_fin - pasos, "plan": plan})
+        CONSULTAS_LENTAS.append({"ts": time.time(), "comando": COMANDO.get(), "busqueda": espec.nombre,
+                                 "generacion": gen.numero, "ms": round(segundos * 1000, 1), "pasos": traza.pasos,
+                                 "cortada": traza.cortada, "sentencias": sentencias, "omitidas": traza.omitidas})
+        sumar("bot_consultas_lentas_total")
+        logging.warning(f"🐢 Búsqueda {espec.nombre} lenta: {segundos * 1000:.0f} ms, ~{traza.pasos} pasos de la VM")
     except Exception as e:
-        return f"⚠️ Error Persona: {e}", False
+        logging.error(f"❌ No se pudo registrar la búsqueda lenta: {e}")
+
+# Render de resultados: el prefijo de cada celda se arma una vez por esquema
+# (la tupla de headers) y la página se junta con un solo join. Se omiten las
+# celdas vacías, NULL o 'nan'/'none' (restos de la planilla original).
+VALORES_VACIOS = frozenset(['nan', 'none', ''])
+
+@functools.lru_cache(maxsize=64)
+def plantilla_fila(headers):
+    return tuple(f"🔹 *{h}:* " for h in headers)
+
+def renderizar_filas(headers, filas):
+    prefijos = plantilla_fila(headers)
+    partes = []
+    for fila in filas:
+        partes.append("\n➖➖➖➖➖\n")
+        for prefijo, valor in zip(prefijos, fila):
+            if valor is None: continue
+            d = valor if type(valor) is str else str(valor)
+            if len(d) > 4 or d.lower() not in VALORES_VACIOS:
+                partes += (prefijo, d, "\n")
+    return "".join(partes)
 
-# D. NUEVO: Búsqueda ASC (Sexo + Clase + Apellido)
-def obtener_datos_asc(sexo, clase, apellido, pagina=0):
-    if not os.path.exists(NOMBRE_DB_LOCAL): return "⚠️ Cargando DB...", False
+# Motor único: conexión prestada -> (clave exacta) -> conteo -> página -> texto.
+# `conocido` = (generación, total, exacto) ya calculado por una página anterior
+# de la misma búsqueda: si es de esta generación no se vuelve a contar.
+# Devuelve (mensaje, tiene_mas, limites, (total, exacto)).
+def ejecutar_busqueda(espec, valores, pagina=0, desde=None, conocido=None):
+    gen = generacion_actual()
+    if gen is None: return "⚠️ Cargando DB...", False, None, (0, True)
+    traza = None
     try:
-        conn = sqlite3.connect(NOMBRE_DB_LOCAL)
-        cursor = conn.cursor()
-        
-        # Filtros: Sexo (=), Clase (=), Apellido (LIKE)
-        condicion = f"{COL_SEXO} = ? COLLATE NOCASE AND {COL_CLASE} = ? COLLATE NOCASE AND {COL_APELLIDO} LIKE ? COLLATE NOCASE"
-        params = (sexo, clase, f"%{apellido}%")
-
-        cursor.execute(f"SELECT COUNT(*) FROM {NOMBRE_TABLA} WHERE {condicion}", params)
-        total = cursor.fetchone()[0]
-        
-        if total == 0:
-            conn.close()
-            return f"❌ Sin resultados ASC.", False
-            
-        paginas_tot = math.ceil(total / RESULTADOS_POR_PAGINA)
-        offset = pagina * RESULTADOS_POR_PAGINA
-        
-        q_data = f"SELECT * FROM {NOMBRE_TABLA} WHERE {condicion} LIMIT {RESULTADOS_POR_PAGINA} OFFSET {offset}"
-        cursor.execute(q_data, params)
-        filas = cursor.fetchall()
-        headers = [d[0] for d in cursor.description]
-        conn.close()
+        t0 = time.perf_counter()
+        with gen.prestar() as conn, trazar(gen, espec, conn) as traza:
+            cursor = conn.cursor()
+            pedir_exacto = bool(desde) and desde[0] == '='
+
+            total = 0
+            if espec.clave_exacta:
+                clave = valores[0].strip()
+                if clave.isascii() and clave.isdigit():
+                    consulta, params = espec.exacta, [int(clave), clave]
+                    total, exacto = contar(gen, cursor, consulta, params, exacto=True)
+                contar_ruta_id('exacta' if total else 'substring')
+
+            if total == 0:
+                consulta, params = espec.consulta(gen, valores)
+                if conocido and conocido[0] == gen.numero and (conocido[2] or not pedir_exacto):
+                    total, exacto = conocido[1:]
+                else:
+                    total, exacto = contar(gen, cursor, consulta, params, pedir_exacto)
+
+            if total == 0:
+                return espec.vacio.format(*valores), False, None, (0, True)
 
-        mensaje = f"🧬 **ASC: {sexo}|{clase}|{apellido}** (Pág {pagina + 1}/{paginas_tot}):\n"
-        for fila in filas:
-            mensaje += "\n➖➖➖➖➖\n"
-            for i in range(len(headers)):
-                d = str(fila[i])
-                if d and d.lower() not in ['nan', 'none', '']:
-                    mensaje += f"🔹 *{headers[i]}:* {d}\n"
-        
-        return mensaje, (pagina + 1) < paginas_tot
+            filas, headers, tiene_mas, limites = leer_pagina(cursor, consulta, params, pagina, desde)
+
+        t1 = time.perf_counter()
+        mensaje = f"{espec.titulo.format(*valores)} ({rotulo_paginas(pagina, total, exacto)}):\n" + renderizar_filas(headers, filas)
+        observar("sql", t1 - t0, "render", time.perf_counter() - t1)
+        sumar("bot_filas_leidas_total", len(filas))
+
+        return mensaje, tiene_mas, limites, (total, exacto)
+    except GeneracionRetirada:
+        # /actualizar cambió la generación entre leerla y pedir la conexión
+        return ejecutar_busqueda(espec, valores, pagina, desde, conocido)
     except Exception as e:
-        return f"⚠️ Error ASC: {e}", False
+        if traza is not None and traza.cortada:
+            sumar("bot_busquedas_cortadas_total")
+            return "✂️ Búsqueda demasiado amplia, refina tu búsqueda (más letras o más filtros).", False, None, (0, True)
+        return f"{espec.error}: {e}", False, None, (0, True)
+
+# A. Búsqueda Simple (Una sola columna)
+def obtener_datos_paginados(columna, valor, pagina=0, desde=None, conocido=None):
+    try: espec = espec_simple(columna)
+    except ValueError as e: return f"⚠️ Error: {e}", False, None, (0, True)
+    return ejecutar_busqueda(espec, [valor], pagina, desde, conocido)
+
+# B. Búsqueda Finder (Sexo + Clase + Domicilio)
+def obtener_datos_combinados(sexo, clase, domicilio, pagina=0, desde=None, conocido=None):
+    return ejecutar_busqueda(ESPEC_FINDER, [sexo, clase, domicilio], pagina, desde, conocido)
+
+# C. Búsqueda Persona (Apellido + Nombre)
+def obtener_datos_persona(apellido, nombre, pagina=0, desde=None, conocido=None):
+    return ejecutar_busqueda(ESPEC_PERSONA, [apellido, nombre], pagina, desde, conocido)
+
+# D. Búsqueda ASC (Sexo + Clase + Apellido)
+def obtener_datos_asc(sexo, clase, apellido, pagina=0, desde=None, conocido=None):
+    return ejecutar_busqueda(ESPEC_ASC, [sexo, clase, apellido], pagina, desde, conocido)
+
+# --- WORKERS SQL (FUERA DEL EVENT LOOP) ---
+# Los motores son síncronos: se ejecutan en un pool de hilos acotado para que
+# un LIKE '%x%' lento no congele al resto de los chats. Con los DB_WORKERS
+# ocupados, las búsquedas esperan en una cola por usuario y los turnos se
+# reparten en ronda entre usuarios: uno que manda muchas no demora a los
+# demás más que una búsqueda por vuelta. Se rechaza la nueva si ya hay
+# DB_COLA_MAX esperando o si su usuario ya tiene COLA_POR_USUARIO.
+_ejecutor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="sql")
+_pendientes = 0  # en ejecución + en cola (solo se toca desde el event loop)
+
+class ColaLlena(Exception):
+    pass
+
+class ColaJusta:
+    def __init__(self, workers):
+        self.libres = workers
+        self.esperando = 0
+        self._colas = OrderedDict()  # usuario -> deque de futures, en orden de ronda
+
+    async def turno(self, usuario):
+        if self.libres > 0 and not self._colas:
+            self.libres -= 1
+            return
+        cola = self._colas.get(usuario)
+        if self.esperando >= DB_COLA_MAX or (cola is not None and len(cola) >= COLA_POR_USUARIO):
+            raise ColaLlena()
+        futuro = asyncio.get_running_loop().create_future()
+        if cola is None: cola = self._colas[usuario] = deque()
+        cola.append(futuro)
+        self.esperando += 1
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            if futuro.done() and not futuro.cancelled():
+                self.liberar()  # el turno llegó junto con la cancelación
+            elif futuro in cola:
+                cola.remove(futuro)
+                self.esperando -= 1
+                if not cola and self._colas.get(usuario) is cola: del self._colas[usuario]
+            raise
+
+    def liberar(self):
+        while self._colas:
+            usuario, cola = next(iter(self._colas.items()))
+            futuro = cola.popleft()
+            if cola: self._colas.move_to_end(usuario)
+            else: del self._colas[usuario]
+            self.esperando -= 1
+            if not futuro.done():
+                futuro.set_result(None)
+                return
+        self.libres += 1
+
+_turnos = ColaJusta(DB_WORKERS)
+
+async def ejecutar_consulta(funcion, *args):
+    global _pendientes
+    encolada = time.perf_counter()
+    try:
+        await _turnos.turno(USUARIO.get())
+    except ColaLlena:
+        sumar("bot_rechazos_total", etiqueta="motivo", valor="cola_llena")
+        raise
+    _pendientes += 1
+    try:
+        contexto = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            _ejecutor, contexto.run, _en_worker, encolada, funcion, *args)
+    finally:
+        _pendientes -= 1
+        _turnos.liberar()
+
+def _en_worker(encolada, funcion, *args):
+    observar("cola", time.perf_counter() - encolada)
+    if _procesos is not None: return _procesos.ejecutar(funcion, args)
+    return funcion(*args)
+
+# --- PROCESOS SQL (OPCIONAL, DB_PROCESOS > 0) ---
+# Con un solo proceso, el SQL y el render de todas las búsquedas comparten el
+# GIL. En este modo cada hilo SQL le pasa su búsqueda a un proceso libre (por
+# un Pipe) y recibe la página ya armada. Cada proceso tiene su propia
+# conexión de solo lectura a la generación activa; la cola justa y los
+# DB_WORKERS hilos siguen igual (conviene DB_WORKERS = DB_PROCESOS). Las
+# métricas, las búsquedas lentas y las rutas de ID que registra el proceso
+# vuelven con cada respuesta y se suman acá.
+#
+# Cambio de generación en dos fases, con todos los procesos tomados (se espera
+# a que terminen sus búsquedas, acotadas por BUSQUEDA_MAX_MS; las nuevas
+# esperan detrás del cambio para no dejarlo sin turno): todos abren la DB
+# nueva antes de publicarla y recién después del cambio de puntero la
+# activan y cierran la vieja. Si alguno no puede abrirla, la descartan todos y
+# la DB se rechaza como cualquier otra validación fallida.
+_procesos = None
+
+class ProcesosSQL:
+    def __init__(self, n):
+        self.n = n
+        self._contexto = multiprocessing.get_context("spawn")  # sin fork de un proceso con hilos y event loop
+        self._libres = queue.LifoQueue()
+        self._tomados = []
+        self._cambio = threading.Lock()  # lo tiene el cambio de generación de preparar a activar
+        self._activa = None  # (número, ruta, filas) que abre un proceso nuevo
+        for _ in range(n): self._libres.put(self._arrancar())
+
+    def _arrancar(self):
+        mio, suyo = self._contexto.Pipe()
+        proceso = self._contexto.Process(target=_proceso_sql, args=(suyo,), name="sql", daemon=True)
+        proceso.start()
+        suyo.close()
+        trabajador = (proceso, mio)
+        if self._activa is not None:
+            self._pedir(trabajador, "abrir", *self._activa)
+            self._pedir(trabajador, "activar")
+        return trabajador
+
+    def _pedir(self, trabajador, *pedido):
+        trabajador[1].send(pedido)
+        estado, valor = trabajador[1].recv()
+        if estado == "error": raise RuntimeError(valor)
+        return valor
+
+    # Si el proceso se cae a mitad de la búsqueda se reemplaza y se reintenta
+    # una vez en el nuevo; si vuelve a caerse, el error llega a responder
+    def ejecutar(self, funcion, args):
+        for intento in range(2):
+            with self._cambio: trabajador = self._libres.get()
+            try:
+                respuesta, metricas = self._pedir(trabajador, "buscar", COMANDO.get(), funcion, args)
+                break
+            except (EOFError, OSError):
+                logging.error("❌ Un proceso SQL terminó, se reemplaza.")
+                trabajador = self._reemplazar(trabajador)
+                if intento: raise
+            finally:
+                self._libres.put(trabajador)
+        sumar_metricas(*metricas)
+        return respuesta
+
+    # Si el nuevo no arranca vuelve el caído: el próximo que lo use lo reintenta
+    def _reemplazar(self, trabajador):
+        trabajador[0].kill()
+        try:
+            return self._arrancar()
+        except Exception as e:
+            logging.error(f"❌ No arrancó el proceso SQL de reemplazo: {e}")
+            return trabajador
+
+    def preparar(self, numero, ruta, filas):
+        self._cambio.acquire()
+        self._tomados = [self._libres.get() for _ in range(self.n)]
+        errores, enviados = [], []
+        for trabajador in self._tomados:
+            try:
+                trabajador[1].send(("abrir", numero, ruta, filas))
+                enviados.append(trabajador)
+            except (EOFError, OSError) as e:
+                errores.append(f"proceso SQL caído: {e!r}")
+        for trabajador in enviados:
+            try:
+                estado, valor = trabajador[1].recv()
+                if estado == "error": errores.append(valor)
+            except (EOFError, OSError) as e:
+                errores.append(f"proceso SQL caído: {e!r}")
+        if errores:
+            self.descartar()
+            raise RuntimeError(f"un proceso SQL no pudo abrir la DB: {errores[0]}")
+
+    def activar(self, numero, filas):
+        self._activa = (numero, os.path.abspath(NOMBRE_DB_LOCAL), filas)
+        self._soltar("activar")
+
+    def descartar(self):
+        self._soltar("descartar")
+
+    # Devuelve los procesos y suelta el cambio pase lo que pase: uno que falla
+    # se reemplaza por otro que abre self._activa
+    def _soltar(self, orden):
+        try:
+            for trabajador in self._tomados:
+                try:
+                    self._pedir(trabajador, orden)
+                except (EOFError, OSError, RuntimeError):
+                    trabajador = self._reemplazar(trabajador)
+                finally:
+                    self._libres.put(trabajador)
+        finally:
+            self._tomados = []
+            self._cambio.release()
+
+    def cerrar(self):
+        for proceso, conexion in [self._libres.get() for _ in range(self.n)]:
+            conexion.close()  # el proceso sale con EOFError
+            proceso.join(5)
+
+def iniciar_procesos():
+    global _procesos
+    _procesos = ProcesosSQL(DB_PROCESOS)
+    logging.info(f"🧵 {DB_PROCESOS} procesos SQL arrancados.")
+
+# Del lado del proceso SQL: lo registrado desde la última respuesta, y la suma
+# en el proceso del bot. De la caché de totales (una por proceso) vuelven los
+# aciertos y fallos; entradas y bytes quedan en cada proceso.
+def metricas_pendientes():
+    with _metricas_lock:
+        latencias = {clave: (h.cuentas, h.suma) for clave, h in LATENCIAS.items()}
+        contadores = dict(CONTADORES)
+        LATENCIAS.clear()
+        CONTADORES.clear()
+    lentas = [CONSULTAS_LENTAS.popleft() for _ in range(len(CONSULTAS_LENTAS))]
+    with _rutas_lock:
+        rutas = dict(RUTAS_ID)
+        for ruta in RUTAS_ID: RUTAS_ID[ruta] = 0
+    return latencias, contadores, lentas, rutas, CACHE_TOTALES.tomar_contadores()
+
+def sumar_metricas(latencias, contadores, lentas, rutas, totales):
+    with _metricas_lock:
+        for clave, (cuentas, suma) in latencias.items():
+            h = LATENCIAS.get(clave) or LATENCIAS.setdefault(clave, Histograma())
+            for i, n in enumerate(cuentas): h.cuentas[i] += n
+            h.suma += suma
+        for clave, n in contadores.items(): CONTADORES[clave] = CONTADORES.get(clave, 0) + n
+    CONSULTAS_LENTAS.extend(lentas)
+    with _rutas_lock:
+        for ruta, n in rutas.items(): RUTAS_ID[ruta] += n
+    CACHE_TOTALES.sumar_contadores(*totales)
+
+# Bucle de cada proceso SQL: una orden por vez, siempre con respuesta
+# ("ok", valor) o ("error", texto). Sale cuando el bot cierra su extremo.
+def _proceso_sql(conexion):
+    global _generacion
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C llega a todo el grupo; lo cierra el bot
+    preparada = None
+    while True:
+        try: pedido = conexion.recv()
+        except (EOFError, OSError): break
+        try:
+            if pedido[0] == "buscar":
+                COMANDO.set(pedido[1])
+                valor = (pedido[2](*pedido[3]), metricas_pendientes())
+            elif pedido[0] == "abrir":
+                if preparada is not None: preparada.retirar()
+                preparada = GeneracionDB(*pedido[1:], tamano=1)
+                valor = preparada.numero
+            elif pedido[0] == "activar":
+                previa, _generacion, preparada = _generacion, preparada, None
+                if previa is not None: previa.retirar()
+                CACHE_TOTALES.limpiar()
+                valor = _generacion.numero
+            else:  # descartar
+                if preparada is not None: preparada.retirar()
+                preparada, valor = None, None
+            respuesta = ("ok", valor)
+        except Exception as e:
+            respuesta = ("error", f"{type(e).__name__}: {e}")
+        try: conexion.send(respuesta)
+        except OSError: break
+
+# Tiempo que cada handler ocupa el event loop: se cronometra cada paso síncrono
+# de la corrutina (entre dos await), que es justo lo que bloquea a los demás.
+BLOQUEO_LOOP = {}  # handler -> {'llamadas', 'total_s', 'max_s'}
+
+@types.coroutine
+def _pasos_medidos(coro, nombre):
+    bloqueo, peor = 0.0, 0.0
+    enviar, lanzar = None, None
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                if lanzar is not None:
+                    pedido = coro.throw(lanzar)
+                else:
+                    pedido = coro.send(enviar)
+            except StopIteration as fin:
+                return fin.value
+            finally:
+                paso = time.perf_counter() - t0
+                bloqueo += paso
+                peor = max(peor, paso)
+            enviar, lanzar = None, None
+            try:
+                enviar = yield pedido
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                lanzar = e
+    finally:
+        stats = BLOQUEO_LOOP.setdefault(nombre, {'llamadas': 0, 'total_s': 0.0, 'max_s': 0.0})
+        stats['llamadas'] += 1
+        stats['total_s'] += bloqueo
+        stats['max_s'] = max(stats['max_s'], peor)
+        if peor * 1000 > BLOQUEO_AVISO_MS:
+            logging.warning(f"🐢 {nombre} bloqueó el loop {peor * 1000:.1f} ms seguidos")
+
+def medir_bloqueo(handler):
+    @functools.wraps(handler)
+    async def envuelto(update, context):
+        COMANDO.set(handler.__name__)  # cada update corre en su propia tarea
+        USUARIO.set(update.effective_user.id if update.effective_user else 0)
+        t0 = time.perf_counter()
+        try:
+            return await _pasos_medidos(handler(update, context), handler.__name__)
+        finally:
+            observar("total", time.perf_counter() - t0)
+    return envuelto
 
 # --- 4. MANEJO DE COMANDOS Y BOTONES ---
 
-def crear_teclado(prefix, datos, pagina, tiene_mas):
+# Estado de paginación del lado del servidor. Cada búsqueda (tipo + datos)
+# tiene un token corto y estable; los botones solo llevan `pg|token|página`
+# (+ `|=` para el total exacto), así el callback_data no depende del largo ni
+# del contenido de lo que se buscó. El estado guarda el primer y último rowid
+# de cada página ya servida (de ahí salen los cursores) y el total contado.
+# Si cambia la generación de la DB se descarta todo y se vuelve a OFFSET.
+class EstadoBusqueda:
+    def __init__(self, token, tipo, datos):
+        self.token = token
+        self.tipo = tipo
+        self.datos = datos
+        self.generacion = None
+        self.paginas = {}   # página -> (primer rowid, último rowid)
+        self.conteo = None  # (total, exacto)
+
+    def sincronizar(self, generacion):
+        if generacion != self.generacion:
+            self.generacion = generacion
+            self.paginas.clear()
+            self.conteo = None
+
+    def conocido(self):
+        return (self.generacion, *self.conteo) if self.conteo else None
+
+    # '>último' de la página anterior, '<primero' de la siguiente, '=primero'
+    # de la misma para recontar exacto; sin vecinos conocidos, OFFSET.
+    def cursor(self, pagina, exacto=False):
+        if exacto and pagina in self.paginas: return f"={self.paginas[pagina][0]}"
+        if pagina - 1 in self.paginas: return f">{self.paginas[pagina - 1][1]}"
+        if pagina + 1 in self.paginas: return f"<{self.paginas[pagina + 1][0]}"
+        return None
+
+    def registrar(self, pagina, limites, conteo):
+        self.paginas[pagina] = limites
+        if self.conteo is None or conteo[1] or not self.conteo[1]: self.conteo = conteo
+
+    def tamano(self):
+        return 400 + tamano_aprox(self.datos) + len(self.paginas) * 150
+
+ESTADOS = CacheLRU(ESTADOS_MAX, ESTADOS_MB * 1024 * 1024, ESTADOS_TTL)
+
+def token_busqueda(tipo, datos, intento=0):
+    clave = (tipo, *datos, intento) if intento else (tipo, *datos)
+    crudo = hashlib.blake2b(repr(clave).encode(), digest_size=6).digest()
+    return base64.urlsafe_b64encode(crudo).decode()
+
+# Busca (o crea) el estado y lo vuelve a guardar: renueva el TTL y el tamaño.
+# El token es un hash corto: si ya lo usa otra búsqueda se prueba el siguiente.
+def estado_busqueda(tipo, datos):
+    intento = 0
+    while True:
+        token = token_busqueda(tipo, datos, intento)
+        estado = ESTADOS.obtener(token)
+        if estado is None or (estado.tipo == tipo and estado.datos == datos): break
+        intento += 1
+    if estado is None: estado = EstadoBusqueda(token, tipo, datos)
+    ESTADOS.guardar(token, estado, estado.tamano())
+    return estado
+
+def datos_boton(token, pagina, exacto=False):
+    return f"pg|{token}|{pagina}" + ("|=" if exacto else "")
+
+def crear_teclado(token, pagina, tiene_mas, limites=None, exacto=True):
     botones = []
-    data_str = "|".join(map(str, datos))
     if pagina > 0:
-        botones.append(InlineKeyboardButton("⬅️ Ant.", callback_data=f"{prefix}|{data_str}|{pagina-1}"))
+        botones.append(InlineKeyboardButton("⬅️ Ant.", callback_data=datos_boton(token, pagina - 1)))
     if tiene_mas:
-        botones.append(InlineKeyboardButton("Sig. ➡️", callback_data=f"{prefix}|{data_str}|{pagina+1}"))
-    return InlineKeyboardMarkup([botones]) if botones else None
+        botones.append(InlineKeyboardButton("Sig. ➡️", callback_data=datos_boton(token, pagina + 1)))
+    filas = [botones] if botones else []
+    if not exacto and limites:
+        filas.append([InlineKeyboardButton("🔢 Total exacto", callback_data=datos_boton(token, pagina, True))])
+    return InlineKeyboardMarkup(filas) if filas else None
 
-async def responder_busqueda(update, columna, valor, pagina=0, es_edicion=False):
-    texto, tiene_mas = obtener_datos_paginados(columna, valor, pagina)
-    teclado = crear_teclado('simple', [columna, valor], pagina, tiene_mas)
+# Páginas ya armadas (texto + teclado) por generación, búsqueda, página,
+# cursor y si el total ya era exacto al armarla: después de "🔢 Total exacto"
+# las páginas con "más de N" y ese botón (p. ej. la precargada) no se vuelven
+# a servir. Al servir la página N se arma la N+1 en segundo plano, solo si hay
+# workers libres, para que "Sig." salga de memoria.
+CACHE_PAGINAS = CacheLRU(CACHE_PAGINAS_MAX, CACHE_PAGINAS_MB * 1024 * 1024, CACHE_PAGINAS_TTL)
+_tareas = set()  # referencia a las tareas de precarga para que no las recoja el GC
+
+# Búsquedas idénticas en vuelo (misma clave que la caché de páginas, que
+# incluye la generación) comparten una sola ejecución: la segunda espera a la
+# primera en vez de repetir el conteo y la página. La entrada se borra al
+# terminar, así que nadie recibe un resultado viejo. Solo desde el event loop.
+_en_vuelo = {}  # clave -> tarea que arma la página
+
+async def armar_pagina(estado, pagina, desde):
+    gen = generacion_actual()
+    clave = (gen.numero if gen else 0, estado.token, pagina, desde, bool(estado.conteo and estado.conteo[1]))
+    pagina_lista = CACHE_PAGINAS.obtener(clave)
+    if pagina_lista is None:
+        tarea = _en_vuelo.get(clave)
+        if tarea is None:
+            tarea = _en_vuelo[clave] = asyncio.ensure_future(_armar_pagina(estado, clave, pagina, desde))
+            tarea.add_done_callback(functools.partial(_aterrizar, clave))
+        else:
+            sumar("bot_busquedas_compartidas_total")
+        pagina_lista = await asyncio.shield(tarea)  # si este pedido se cancela, los demás siguen esperando
+    if pagina_lista[3] is not None and gen and estado.generacion == gen.numero:
+        estado.registrar(pagina, pagina_lista[3], pagina_lista[4])
+    return pagina_lista
+
+async def _armar_pagina(estado, clave, pagina, desde):
+    texto, tiene_mas, limites, conteo = await ejecutar_consulta(MOTORES[estado.tipo], *estado.datos, pagina, desde, estado.conocido())
+    teclado = crear_teclado(estado.token, pagina, tiene_mas, limites, conteo[1])
+    pagina_lista = (texto, teclado, tiene_mas, limites, conteo)
+    if limites is not None:  # solo páginas con filas; errores y "Cargando" no
+        botones = [b for fila in (teclado.inline_keyboard if teclado else ()) for b in fila]
+        tam = tamano_aprox(clave) + sys.getsizeof(texto) + sum(sys.getsizeof(b.callback_data) + 200 for b in botones)
+        CACHE_PAGINAS.guardar(clave, pagina_lista, tam)
+    return pagina_lista
+
+def _aterrizar(clave, tarea):
+    _en_vuelo.pop(clave, None)
+    if not tarea.cancelled(): tarea.exception()  # marcada como leída aunque todos los que esperaban se hayan ido
+
+async def precargar(estado, pagina):
+    COMANDO.set("precarga")
+    if _pendientes >= DB_WORKERS: return
+    try:
+        await armar_pagina(estado, pagina, estado.cursor(pagina))
+    except Exception as e:
+        logging.debug(f"Precarga descartada: {e}")
+
+async def responder(update, estado, pagina, es_edicion, exacto=False):
+    gen = generacion_actual()
+    estado.sincronizar(gen.numero if gen else None)
+    try:
+        texto, teclado, tiene_mas, limites, _ = await armar_pagina(estado, pagina, estado.cursor(pagina, exacto))
+    except ColaLlena:
+        texto, teclado, tiene_mas, limites = "⏳ Hay muchas búsquedas en curso, intenta en unos segundos.", None, False, None
+    except (EOFError, OSError):  # se cayó el proceso SQL dos veces seguidas
+        texto, teclado, tiene_mas, limites = "⚠️ Falló la búsqueda, intenta de nuevo.", None, False, None
     await enviar_respuesta(update, texto, teclado, es_edicion)
+    if PRECARGA and tiene_mas and limites:
+        tarea = asyncio.create_task(precargar(estado, pagina + 1))
+        _tareas.add(tarea)
+        tarea.add_done_callback(_tareas.discard)
+
+MOTORES = {'simple': obtener_datos_paginados, 'finder': obtener_datos_combinados,
+           'persona': obtener_datos_persona, 'asc': obtener_datos_asc}
+
+async def responder_busqueda(update, columna, valor, pagina=0, es_edicion=False):
+    await responder(update, estado_busqueda('simple', [columna, valor]), pagina, es_edicion)
 
 async def responder_finder(update, sexo, clase, domicilio, pagina=0, es_edicion=False):
-    texto, tiene_mas = obtener_datos_combinados(sexo, clase, domicilio, pagina)
-    teclado = crear_teclado('finder', [sexo, clase, domicilio], pagina, tiene_mas)
-    await enviar_respuesta(update, texto, teclado, es_edicion)
+    await responder(update, estado_busqueda('finder', [sexo, clase, domicilio]), pagina, es_edicion)
 
 async def responder_persona(update, apellido, nombre, pagina=0, es_edicion=False):
-    texto, tiene_mas = obtener_datos_persona(apellido, nombre, pagina)
-    teclado = crear_teclado('persona', [apellido, nombre], pagina, tiene_mas)
-    await enviar_respuesta(update, texto, teclado, es_edicion)
+    await responder(update, estado_busqueda('persona', [apellido, nombre]), pagina, es_edicion)
 
 async def responder_asc(update, sexo, clase, apellido, pagina=0, es_edicion=False):
-    texto, tiene_mas = obtener_datos_asc(sexo, clase, apellido, pagina)
-    teclado = crear_teclado('asc', [sexo, clase, apellido], pagina, tiene_mas)
-    await enviar_respuesta(update, texto, teclado, es_edicion)
+    await responder(update, estado_busqueda('asc', [sexo, clase, apellido]), pagina, es_edicion)
 
 async def enviar_respuesta(update, texto, teclado, es_edicion):
     if es_edicion:
@@ -254,6 +1482,44 @@ async def enviar_respuesta(update, texto, teclado, es_edicion):
     else:
         await update.message.reply_text(texto, parse_mode='Markdown', reply_markup=teclado)
 
+# --- ADMISIÓN ---
+# Corre antes que cualquier handler (grupo -1). Un rechazo corta el update con
+# ApplicationHandlerStop sin tocar la DB. Los ADMIN_IDS no pasan por la lista
+# ni por el límite. Cubeta de fichas por usuario: [fichas, último, avisado];
+# se avisa una vez por racha de rechazos para no gastar más llamadas.
+_cubetas = {}  # usuario -> cubeta (solo desde el event loop)
+
+def tomar_ficha(usuario, ahora):
+    cubeta = _cubetas.get(usuario)
+    if cubeta is None:
+        if len(_cubetas) >= CUBETAS_MAX:  # se olvidan las que ya se llenaron de nuevo
+            for u in [u for u, c in _cubetas.items() if c[0] + (ahora - c[1]) * TASA_USUARIO >= RAFAGA_USUARIO]:
+                del _cubetas[u]
+        cubeta = _cubetas[usuario] = [RAFAGA_USUARIO, ahora, False]
+    fichas = min(RAFAGA_USUARIO, cubeta[0] + (ahora - cubeta[1]) * TASA_USUARIO)
+    cubeta[1] = ahora
+    if fichas >= 1:
+        cubeta[0], cubeta[2] = fichas - 1, False
+        return True, False
+    avisar = not cubeta[2]
+    cubeta[0], cubeta[2] = fichas, True
+    return False, avisar
+
+async def admitir(update, context):
+    usuario = update.effective_user.id if update.effective_user else None
+    if usuario in ADMIN_IDS: return
+    if USUARIOS_PERMITIDOS and usuario not in USUARIOS_PERMITIDOS:
+        sumar("bot_rechazos_total", etiqueta="motivo", valor="no_autorizado")
+        raise ApplicationHandlerStop
+    if TASA_USUARIO > 0 and usuario is not None:
+        admitido, avisar = tomar_ficha(usuario, time.monotonic())
+        if admitido: return
+        sumar("bot_rechazos_total", etiqueta="motivo", valor="tasa")
+        aviso = "⏳ Vas muy rápido, espera unos segundos."
+        if update.callback_query: await update.callback_query.answer(aviso if avisar else None)
+        elif avisar and update.effective_message: await update.effective_message.reply_text(aviso)
+        raise ApplicationHandlerStop
+
 # --- HANDLERS ---
 
 async def cmd_asc(update, context):
@@ -304,7 +1570,19 @@ async def boton_callback(update, context):
     await query.answer()
     datos = query.data.split('|')
     tipo = datos[0]
-    
+
+    if tipo == 'pg':
+        # pg|token|pagina[|=]
+        estado = ESTADOS.obtener(datos[1])
+        if estado is None:
+            await enviar_respuesta(update, "⌛ Esta búsqueda expiró, vuelve a enviarla.", None, True)
+            return
+        ESTADOS.guardar(estado.token, estado, estado.tamano())
+        await responder(update, estado, int(datos[2]), True, datos[-1] == '=')
+        return
+
+    # Botones de versiones anteriores: prefix|datos...|pagina[|cursor]
+    if datos[-1][:1] in ('<', '>', '=') and datos[-1][1:].isdigit(): datos.pop()
     if tipo == 'simple':
         await responder_busqueda(update, datos[1], datos[2], int(datos[3]), True)
     elif tipo == 'finder':
@@ -312,7 +1590,6 @@ async def boton_callback(update, context):
     elif tipo == 'persona':
         await responder_persona(update, datos[1], datos[2], int(datos[3]), True)
     elif tipo == 'asc':
-        # asc|sexo|clase|apellido|pagina
         await responder_asc(update, datos[1], datos[2], datos[3], int(datos[4]), True)
 
 async def start(update, context):
@@ -328,27 +1605,96 @@ async def start(update, context):
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 async def reload_db(update, context):
-    if descargar_db(): await update.message.reply_text("✅ Actualizado.")
+    estado = await asyncio.to_thread(actualizar_db)
+    if estado == DESCARGADA: await update.message.reply_text(f"✅ Actualizado (generación {generacion_actual().numero}).")
+    elif estado == SIN_CAMBIOS: await update.message.reply_text("✅ Sin cambios, la DB ya está al día.")
     else: await update.message.reply_text("❌ Error.")
 
+async def estado(update, context):
+    gen = generacion_actual()
+    lineas = [f"🗄️ **DB:** " + (f"generación {gen.numero}, {gen.filas} filas, {gen.bytes / 1024 / 1024:.1f} MB, índices en {ULTIMA_CARGA.get('indices_s', 0):.1f}s" if gen else "sin cargar"),
+              f"🆔 **Búsquedas de ID:** {RUTAS_ID['exacta']} exactas, {RUTAS_ID['substring']} por substring",
+              f"🧮 **Caché de totales:** {len(CACHE_TOTALES)} entradas, {CACHE_TOTALES.bytes / 1024:.0f} KB, {CACHE_TOTALES.aciertos} aciertos / {CACHE_TOTALES.fallos} fallos",
+              f"📄 **Caché de páginas:** {len(CACHE_PAGINAS)} entradas, {CACHE_PAGINAS.bytes / 1024:.0f} KB, {CACHE_PAGINAS.aciertos} aciertos / {CACHE_PAGINAS.fallos} fallos",
+              f"🔖 **Búsquedas paginables:** {len(ESTADOS)} estados, {ESTADOS.bytes / 1024:.0f} KB",
+              f"⚙️ **Workers SQL:** {_pendientes}/{DB_WORKERS} ocupados, {_turnos.esperando} en espera de {len(_turnos._colas)} usuarios (máx {DB_COLA_MAX})"
+              + (f", {_procesos.n} procesos" if _procesos else ""), "", "⏱️ **Bloqueo del loop por handler:**"]
+    for nombre, st in sorted(BLOQUEO_LOOP.items()):
+        prom = st['total_s'] / st['llamadas'] * 1000
+        lineas.append(f"🔹 `{nombre}`: {st['llamadas']} llamadas, prom {prom:.2f} ms, máx {st['max_s'] * 1000:.2f} ms")
+    await update.message.reply_text("\n".join(lineas), parse_mode='Markdown')
+
+# Últimas búsquedas lentas con su plan (solo ADMIN_IDS). Sin Markdown: el SQL
+# trae '*' y '_'.
+async def lentas(update, context):
+    if update.effective_user.id not in ADMIN_IDS: return
+    if not CONSULTAS_LENTAS:
+        await update.message.reply_text("✅ Sin búsquedas lentas registradas.")
+        return
+    bloques = []
+    for e in reversed(list(CONSULTAS_LENTAS)[-5:]):
+        lineas = [f"{'✂️' if e['cortada'] else '🐢'} {time.strftime('%d/%m %H:%M:%S', time.localtime(e['ts']))} {e['comando']} ({e['busqueda']}): {e['ms']} ms, ~{e['pasos']} pasos, gen {e['generacion']}"]
+        for st in e["sentencias"]:
+            lineas.append(f"  {st['ms']} ms, ~{st['pasos']} pasos: {st['sql']}  {st['formas']}")
+            lineas.extend(f"    → {paso}" for paso in st["plan"])
+        if e["omitidas"]: lineas.append(f"  (+{e['omitidas']} sentencias sin registrar)")
+        bloques.append("\n".join(lineas))
+    await update.message.reply_text("\n\n".join(bloques)[:4000])
+
 # --- ARRANQUE ---
+# Primero la copia local de la última ejecución (si valida); la descarga
+# condicional después solo baja algo si el origen cambió.
+def carga_inicial():
+    if DB_PROCESOS > 0: iniciar_procesos()
+    if os.path.exists(NOMBRE_DB_LOCAL): publicar_db(NOMBRE_DB_LOCAL)
+    if actualizar_db() == FALLIDA and generacion_actual() is None: print("⚠️ Sin DB inicial")
+
+async def principal(app_bot):
+    # El servidor web sale primero para que la salud responda durante la descarga
+    runner = await iniciar_servidor(app_bot)
+    await asyncio.to_thread(carga_inicial)
+
+    fin = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(sig, fin.set)
+
+    async with app_bot:
+        if DB_REFRESCO_MIN > 0: programar_refresco(app_bot.job_queue)
+        await app_bot.start()
+        if MODO == "webhook":
+            if WEBHOOK_URL:
+                await app_bot.bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_RUTA, secret_token=WEBHOOK_SECRET,
+                                              allowed_updates=Update.ALL_TYPES)
+        else:
+            await app_bot.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        print(f"🤖 Bot v5 LISTO ({MODO})")
+        try:
+            await fin.wait()
+        finally:
+            if app_bot.updater.running: await app_bot.updater.stop()
+            await app_bot.stop()
+            await runner.cleanup()
+            if _procesos is not None: await asyncio.to_thread(_procesos.cerrar)
+
 if __name__ == '__main__':
-    keep_alive()
-    if not descargar_db(): print("⚠️ Sin DB inicial")
-    
-    app_bot = ApplicationBuilder().token(TOKEN).build()
+    if MODO == "webhook" and not WEBHOOK_SECRET: sys.exit("❌ MODO=webhook necesita WEBHOOK_SECRET")
+    constructor = ApplicationBuilder().token(TOKEN).concurrent_updates(DB_WORKERS + DB_COLA_MAX)
+    if BOT_API_URL: constructor = constructor.base_url(BOT_API_URL.rstrip("/") + "/bot")
+    app_bot = constructor.build()
     
-    app_bot.add_handler(CommandHandler('start', start))
-    app_bot.add_handler(CommandHandler('actualizar', reload_db))
-    app_bot.add_handler(CommandHandler('apellido', cmd_apellido))
-    app_bot.add_handler(CommandHandler('nombre', cmd_nombre))
-    app_bot.add_handler(CommandHandler('domicilio', cmd_domicilio))
-    app_bot.add_handler(CommandHandler('finder', cmd_finder))
-    app_bot.add_handler(CommandHandler('persona', cmd_persona))
-    app_bot.add_handler(CommandHandler('asc', cmd_asc)) # <--- COMANDO ASC REGISTRADO
+    app_bot.add_handler(TypeHandler(Update, admitir), group=-1)
+    app_bot.add_handler(CommandHandler('start', medir_bloqueo(start)))
+    app_bot.add_handler(CommandHandler('actualizar', medir_bloqueo(reload_db)))
+    app_bot.add_handler(CommandHandler('apellido', medir_bloqueo(cmd_apellido)))
+    app_bot.add_handler(CommandHandler('nombre', medir_bloqueo(cmd_nombre)))
+    app_bot.add_handler(CommandHandler('domicilio', medir_bloqueo(cmd_domicilio)))
+    app_bot.add_handler(CommandHandler('finder', medir_bloqueo(cmd_finder)))
+    app_bot.add_handler(CommandHandler('persona', medir_bloqueo(cmd_persona)))
+    app_bot.add_handler(CommandHandler('asc', medir_bloqueo(cmd_asc))) # <--- COMANDO ASC REGISTRADO
+    app_bot.add_handler(CommandHandler('estado', medir_bloqueo(estado)))
+    app_bot.add_handler(CommandHandler('lentas', medir_bloqueo(lentas)))
     
-    app_bot.add_handler(CallbackQueryHandler(boton_callback))
-    app_bot.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), buscar_general))
-    
-    print("🤖 Bot v5 LISTO")
-    app_bot.run_polling()
\ No newline at end of file
+    app_bot.add_handler(CallbackQueryHandler(medir_bloqueo(boton_callback)))
+    app_bot.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), medir_bloqueo(buscar_general)))
+
+    asyncio.run(principal(app_bot))